@@ -0,0 +1,83 @@
+# Бенчмарк: рассылка рекламы по всем пользователям (broadcast.AdBroadcaster)
+#
+# Отправка подменена заглушкой с задержкой --latency, поэтому замеряется сам
+# движок: чтение users пачками, параллельная отправка и запись итогов пачек.
+# С реальным Telegram время ограничено лимитом 30 сообщений/с на бота.
+#
+# Запуск из каталога file: python benchmarks/ad_broadcast.py [--users 1000000] [--latency 0.001]
+
+import argparse
+import asyncio
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broadcast import AdBroadcaster
+from database import Database
+
+
+class StubBot:
+    def __init__(self, latency):
+        self.latency = latency
+        self.sent = 0
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+
+
+def fill(path, users):
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO users (user_id) VALUES (?)', ((u,) for u in range(1, users + 1)))
+    conn.execute("INSERT INTO ads (id, text) VALUES (1, 'Реклама')")
+    conn.commit()
+    conn.close()
+
+
+async def run(args):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    db = Database(path)
+    await db.migrate()
+    await db.close()
+
+    started = time.perf_counter()
+    fill(path, args.users)
+    print(f"Заполнено {args.users} пользователей за {time.perf_counter() - started:.1f} с")
+
+    db = Database(path)
+    bot = StubBot(args.latency)
+    broadcaster = AdBroadcaster(bot, db, concurrency=args.concurrency)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    await broadcaster.start(1)
+    while broadcaster._tasks:
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - started
+
+    state = await db.get_ad_broadcast(1)
+    ad = await db.get_ad(1)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"Отправлено {bot.sent} за {elapsed:.1f} с ({bot.sent / elapsed:.0f} сообщ./с), "
+          f"статус {state['status']}, views {ad['views']}")
+    print(f"Рост пикового RSS за рассылку: {(rss_after - rss_before) / 1024:.1f} МБ")
+
+    await db.close()
+    os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--latency', type=float, default=0.001)
+    parser.add_argument('--concurrency', type=int, default=32)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# Проверка аренды розыгрышей: несколько процессов бота на одном файле SQLite
+#
+# Запускает --instances процессов с GiveawaySystem(instance_id=...), затем
+# создает --giveaways розыгрышей, завершающихся в течение --spread секунд
+# (процессы подхватывают их при продлении аренд). Через --kill-after секунд
+# убивает (SIGKILL) процесс с наибольшим числом аренд и проверяет, что
+# каждый розыгрыш выплачен ровно один раз и с задержкой не больше срока аренды.
+#
+# Запуск из каталога file: python benchmarks/multi_instance.py [--instances 3] [--giveaways 50]
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from giveaway_system import GiveawaySystem
+
+PARTICIPANTS = 20
+WINNERS = 3
+
+
+class StubBot:
+    '''Заглушка Bot API без сети'''
+
+    async def _message(self, *args, **kwargs):
+        return SimpleNamespace(message_id=1, photo=None)
+
+    send_message = send_photo = edit_message_text = edit_message_caption = _message
+
+    async def get_chat(self, chat_id):
+        return SimpleNamespace(username=None)
+
+    async def me(self):
+        return SimpleNamespace(username='bench_bot')
+
+
+def worker(path, name, ttl, heartbeat, ready, stop):
+    async def run():
+        db = Database(path)
+        system = GiveawaySystem(StubBot(), db, instance_id=name, lease_ttl=ttl, lease_heartbeat=heartbeat)
+        await system.restore_active_giveaways()
+        ready.release()
+        while not stop.is_set():
+            await asyncio.sleep(0.2)
+        await system.close()
+        await db.close()
+
+    asyncio.run(run())
+
+
+def fill(path, giveaways, spread):
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO users (user_id) VALUES (?)', ((u,) for u in range(1, PARTICIPANTS + 1)))
+    for i in range(1, giveaways + 1):
+        # Длительность 1 минута, created_at сдвинут так, что конец через 3..3+spread секунд
+        offset = 3 + spread * i / giveaways
+        conn.execute(
+            "INSERT INTO giveaways_v2 (id, creator_id, target_type, target_id, prize_amount, currency, "
+            "winners_count, duration_minutes, strategy, message_id, status, created_at) "
+            "VALUES (?, 1, 'channel', '@bench', 90, 'USDT', ?, 1, 'random', 1, 'active', "
+            "datetime('now', '-60 seconds', ?))",
+            (i, WINNERS, f"+{offset:.3f} seconds")
+        )
+    conn.executemany(
+        'INSERT INTO participants (giveaway_id, user_id) VALUES (?, ?)',
+        ((g, u) for g in range(1, giveaways + 1) for u in range(1, PARTICIPANTS + 1))
+    )
+    conn.commit()
+    conn.close()
+
+
+async def migrate(path):
+    db = Database(path)
+    await db.migrate()
+    await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--instances', type=int, default=3)
+    parser.add_argument('--giveaways', type=int, default=50)
+    parser.add_argument('--spread', type=float, default=20.0)
+    parser.add_argument('--kill-after', type=float, default=5.0)
+    parser.add_argument('--ttl', type=float, default=3.0)
+    parser.add_argument('--heartbeat', type=float, default=1.0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    asyncio.run(migrate(path))
+
+    context = multiprocessing.get_context('spawn')
+    ready = context.Semaphore(0)
+    stop = context.Event()
+    processes = {
+        f"bench-{i}": context.Process(target=worker, args=(path, f"bench-{i}", args.ttl, args.heartbeat, ready, stop))
+        for i in range(args.instances)
+    }
+    for process in processes.values():
+        process.start()
+    for _ in processes:
+        ready.acquire()
+
+    fill(path, args.giveaways, args.spread)
+    time.sleep(args.kill_after)
+    conn = sqlite3.connect(path, timeout=30)
+    owners = conn.execute(
+        'SELECT owner, COUNT(*) FROM giveaway_leases GROUP BY owner ORDER BY COUNT(*) DESC'
+    ).fetchall()
+    print(f"Аренды через {args.kill_after:.0f} с: {owners}")
+    if owners:
+        victim = owners[0][0]
+        processes[victim].kill()
+        print(f"Убит {victim} (SIGKILL, аренды не освобождены)")
+
+    time.sleep(3 + args.spread - args.kill_after + args.ttl + args.heartbeat + 2)
+    stop.set()
+    for process in processes.values():
+        process.join()
+
+    statuses = dict(conn.execute('SELECT status, COUNT(*) FROM giveaways_v2 GROUP BY status').fetchall())
+    payouts = conn.execute(
+        "SELECT COUNT(*) FROM transactions WHERE type = 'win' GROUP BY description"
+    ).fetchall()
+    wins = conn.execute('SELECT SUM(giveaways_won) FROM users').fetchone()[0]
+    lateness = conn.execute(
+        "SELECT MAX(strftime('%s', finished_at) - strftime('%s', created_at, '+60 seconds')) FROM giveaways_v2"
+    ).fetchone()[0]
+    conn.close()
+
+    double_paid = sum(1 for (count,) in payouts if count != WINNERS)
+    print(f"Статусы: {statuses}")
+    print(f"Розыгрышей с выплатами: {len(payouts)}, с неверным числом выплат: {double_paid}, "
+          f"побед у пользователей: {wins} (ожидается {args.giveaways * WINNERS})")
+    print(f"Максимальная задержка завершения: {lateness} с")
+    ok = statuses == {'finished': args.giveaways} and double_paid == 0 and wins == args.giveaways * WINNERS
+    print('OK' if ok else 'ОШИБКА')
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Бенчмарк: поиск участников до и после индексов миграции 3 (migrations._create_indexes)
+#
+# Запуск: python benchmarks/participants_index.py [--rows 10000000] [--giveaways 10000]
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+QUERIES = {
+    'get_participants': ('SELECT user_id FROM participants WHERE giveaway_id = ?', 'giveaway'),
+    'get_participants_with_time': (
+        'SELECT user_id, joined_at FROM participants WHERE giveaway_id = ? ORDER BY joined_at', 'giveaway'
+    ),
+    'is_participant': ('SELECT 1 FROM participants WHERE giveaway_id = ? AND user_id = ?', 'pair'),
+}
+
+INDEXES = (
+    'CREATE UNIQUE INDEX idx_participants_giveaway_user ON participants (giveaway_id, user_id)',
+    'CREATE INDEX idx_participants_giveaway_joined ON participants (giveaway_id, joined_at)',
+)
+
+
+def fill(conn, rows, giveaways):
+    conn.execute('''
+        CREATE TABLE participants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            giveaway_id INTEGER,
+            user_id INTEGER,
+            is_winner INTEGER DEFAULT 0,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    per_giveaway = rows // giveaways
+    chunk = []
+    for i in range(rows):
+        chunk.append((i % giveaways + 1, i // giveaways + 1, f"2025-01-01 00:{i // giveaways % 60:02d}:00"))
+        if len(chunk) == 100_000:
+            conn.executemany('INSERT INTO participants (giveaway_id, user_id, joined_at) VALUES (?, ?, ?)', chunk)
+            chunk = []
+    if chunk:
+        conn.executemany('INSERT INTO participants (giveaway_id, user_id, joined_at) VALUES (?, ?, ?)', chunk)
+    conn.commit()
+    return per_giveaway
+
+
+def measure(conn, giveaways, per_giveaway, repeats):
+    rng = random.Random(42)
+    results = {}
+    for name, (sql, kind) in QUERIES.items():
+        started = time.perf_counter()
+        for _ in range(repeats):
+            giveaway_id = rng.randint(1, giveaways)
+            if kind == 'giveaway':
+                conn.execute(sql, (giveaway_id,)).fetchall()
+            else:
+                conn.execute(sql, (giveaway_id, rng.randint(1, per_giveaway))).fetchone()
+        results[name] = (time.perf_counter() - started) / repeats * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--giveaways', type=int, default=10_000)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+
+    started = time.perf_counter()
+    per_giveaway = fill(conn, args.rows, args.giveaways)
+    print(f"Заполнено {args.rows} строк за {time.perf_counter() - started:.1f} с")
+
+    before = measure(conn, args.giveaways, per_giveaway, args.repeats)
+
+    started = time.perf_counter()
+    for sql in INDEXES:
+        conn.execute(sql)
+    conn.commit()
+    print(f"Индексы построены за {time.perf_counter() - started:.1f} с")
+
+    after = measure(conn, args.giveaways, per_giveaway, args.repeats * 100)
+
+    print(f"{'запрос':<28}{'без индекса, мс':>18}{'с индексом, мс':>18}")
+    for name in QUERIES:
+        print(f"{name:<28}{before[name]:>18.3f}{after[name]:>18.3f}")
+
+    conn.close()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# Бенчмарк: восстановление активных розыгрышей при перезапуске (GiveawaySystem.restore_active_giveaways)
+#
+# Запуск из каталога file: python benchmarks/restore_active_giveaways.py [--giveaways 10000] [--participants 100]
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from giveaway_system import GiveawaySystem
+
+
+def fill(path, giveaways, participants):
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO giveaways_v2 (id, creator_id, target_type, target_id, prize_amount, currency, "
+        "winners_count, duration_minutes, strategy, message_id, status) "
+        "VALUES (?, 1, 'channel', '@bench', 100, 'USDT', 3, 1440, 'random', ?, 'active')",
+        ((i, i) for i in range(1, giveaways + 1))
+    )
+    conn.executemany(
+        'INSERT INTO participants (giveaway_id, user_id) VALUES (?, ?)',
+        ((g, u) for g in range(1, giveaways + 1) for u in range(1, participants + 1))
+    )
+    conn.commit()
+    conn.close()
+
+
+async def run(args):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    db = Database(path)
+    await db.migrate()
+    await db.close()
+
+    started = time.perf_counter()
+    fill(path, args.giveaways, args.participants)
+    print(f"Заполнено {args.giveaways} розыгрышей x {args.participants} участников "
+          f"за {time.perf_counter() - started:.1f} с")
+
+    db = Database(path)
+    system = GiveawaySystem(bot=None, db=db)
+    started = time.perf_counter()
+    restored = await system.restore_active_giveaways()
+    elapsed = time.perf_counter() - started
+    total = sum(len(g['participants']) for g in system.active_giveaways.values())
+    print(f"Восстановлено {restored} розыгрышей ({total} участников) за {elapsed:.3f} с")
+
+    await system.close()
+    await db.close()
+    os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--giveaways', type=int, default=10_000)
+    parser.add_argument('--participants', type=int, default=100)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
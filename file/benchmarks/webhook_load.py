@@ -0,0 +1,162 @@
+# Нагрузочный стенд режима webhook без настоящего Telegram
+#
+# Поднимает поддельный сервер Bot API, запускает main.py с BOT_MODE=webhook
+# и TELEGRAM_API_URL на этот сервер, затем шлет на вебхук --updates
+# обновлений /start от разных пользователей (до --concurrency параллельно).
+# Замеряет скорость приема вебхуком и полный цикл до ответа sendMessage.
+#
+# Запуск из каталога file: python benchmarks/webhook_load.py [--updates 5000] [--concurrency 100]
+
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession, web
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+TOKEN = '123456:bench'
+SECRET = 'bench-secret'
+WEBHOOK_PATH = '/webhook'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class FakeTelegram:
+    '''Поддельный Bot API: отвечает успехом на все методы и запоминает время ответов бота'''
+
+    def __init__(self):
+        self.webhook_set = asyncio.Event()
+        self.replies = {}  # chat_id -> время sendMessage
+        self.all_replied = asyncio.Event()
+        self.expected = 0
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        data = dict(await request.post()) if request.can_read_body else {}
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method == 'sendMessage':
+            chat_id = int(data['chat_id'])
+            self.replies.setdefault(chat_id, time.perf_counter())
+            if len(self.replies) >= self.expected:
+                self.all_replied.set()
+            result = {'message_id': 1, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}}
+        else:
+            if method == 'setWebhook':
+                self.webhook_set.set()
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+
+def make_update(update_id: int, user_id: int) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'u{user_id}'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': user,
+            'text': '/start',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        },
+    }
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+async def run(args):
+    telegram = FakeTelegram()
+    telegram.expected = args.updates
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', telegram.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    api_port = free_port()
+    await web.TCPSite(runner, '127.0.0.1', api_port).start()
+
+    bot_port = free_port()
+    env = dict(
+        os.environ,
+        BOT_TOKEN=TOKEN, ADMIN_ID='1', BOT_MODE='webhook',
+        TELEGRAM_API_URL=f'http://127.0.0.1:{api_port}',
+        TELEGRAM_GLOBAL_RATE=str(args.global_rate),
+        WEBHOOK_HOST='127.0.0.1', WEBHOOK_PORT=str(bot_port), WEBHOOK_PATH=WEBHOOK_PATH,
+        WEBHOOK_URL=f'http://127.0.0.1:{bot_port}', WEBHOOK_SECRET=SECRET,
+    )
+    workdir = tempfile.mkdtemp()
+    bot_process = await asyncio.create_subprocess_exec(
+        sys.executable, args.main, cwd=workdir, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        await asyncio.wait_for(telegram.webhook_set.wait(), args.startup_timeout)
+        url = f'http://127.0.0.1:{bot_port}{WEBHOOK_PATH}'
+
+        async with ClientSession() as http:
+            async with http.post(url, json=make_update(0, 1), headers={
+                'X-Telegram-Bot-Api-Secret-Token': 'wrong'
+            }) as response:
+                print(f"Запрос с неверным секретом: HTTP {response.status}")
+
+            sent_at = {}
+            queue = asyncio.Queue()
+            for i in range(1, args.updates + 1):
+                queue.put_nowait(i)
+
+            async def client():
+                while not queue.empty():
+                    i = queue.get_nowait()
+                    user_id = 1_000_000 + i
+                    sent_at[user_id] = time.perf_counter()
+                    async with http.post(url, json=make_update(i, user_id), headers={
+                        'X-Telegram-Bot-Api-Secret-Token': SECRET
+                    }) as response:
+                        response.raise_for_status()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(client() for _ in range(args.concurrency)))
+            accepted = time.perf_counter() - started
+            await asyncio.wait_for(telegram.all_replied.wait(), args.updates / 50 + 30)
+            handled = time.perf_counter() - started
+
+        latencies = [(telegram.replies[u] - sent_at[u]) * 1000 for u in sent_at if u in telegram.replies]
+        print(f"Принято {args.updates} обновлений за {accepted:.2f} с ({args.updates / accepted:.0f}/с)")
+        print(f"Обработано с ответом за {handled:.2f} с ({args.updates / handled:.0f}/с)")
+        print(f"Задержка до ответа, мс: p50 {percentile(latencies, 0.5):.1f}, "
+              f"p95 {percentile(latencies, 0.95):.1f}, p99 {percentile(latencies, 0.99):.1f}")
+    finally:
+        if bot_process.returncode is None:
+            bot_process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(bot_process.wait(), 15)
+            except asyncio.TimeoutError:
+                bot_process.kill()
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--global-rate', type=float, default=100_000,
+                        help='лимит сообщений/с бота (у настоящего Telegram 30)')
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--main', default=MAIN, help='путь к main.py')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
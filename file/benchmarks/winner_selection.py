@@ -0,0 +1,95 @@
+# Бенчмарк: выбор победителей стратегий first и active (GiveawaySystem._select_winners)
+#
+# Запуск из каталога file: python benchmarks/winner_selection.py [--participants 100000] [--winners 10]
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+GIVEAWAY_ID = 1
+
+
+def fill(path, participants):
+    rng = random.Random(42)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        'INSERT INTO users (user_id, giveaways_participated) VALUES (?, ?)',
+        ((u, rng.randint(0, 50)) for u in range(1, participants + 1))
+    )
+    conn.executemany(
+        'INSERT INTO participants (giveaway_id, user_id, joined_at) VALUES (?, ?, ?)',
+        ((GIVEAWAY_ID, u, f"2025-01-01 {u // 3600 % 24:02d}:{u // 60 % 60:02d}:{u % 60:02d}")
+         for u in rng.sample(range(1, participants + 1), participants))
+    )
+    conn.commit()
+    conn.close()
+
+
+async def first_in_python(db, winners):
+    '''Прежняя реализация: все участники с временем и сортировка в Python'''
+    participants = await db.get_participants_with_time(GIVEAWAY_ID)
+    participants.sort(key=lambda x: x['joined_at'])
+    return [p['user_id'] for p in participants[:winners]]
+
+
+async def active_per_user(db, winners):
+    '''Прежняя реализация: get_user на каждого участника и сортировка в Python'''
+    data = []
+    for user_id in await db.get_participants(GIVEAWAY_ID):
+        user = await db.get_user(user_id)
+        data.append((user_id, user['giveaways_participated']))
+    data.sort(key=lambda x: x[1], reverse=True)
+    return [user_id for user_id, _ in data[:winners]]
+
+
+async def timed(coro):
+    started = time.perf_counter()
+    result = await coro
+    return result, (time.perf_counter() - started) * 1000
+
+
+async def run(args):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    db = Database(path)
+    await db.migrate()
+    await db.close()
+
+    started = time.perf_counter()
+    fill(path, args.participants)
+    print(f"Заполнено {args.participants} участников за {time.perf_counter() - started:.1f} с")
+
+    db = Database(path)
+    cases = (
+        ('first', first_in_python(db, args.winners), db.get_first_participants(GIVEAWAY_ID, args.winners)),
+        ('active', active_per_user(db, args.winners), db.get_most_active_participants(GIVEAWAY_ID, args.winners)),
+    )
+    print(f"{'стратегия':<12}{'было, мс':>14}{'SQL top-k, мс':>16}")
+    for name, old, new in cases:
+        old_winners, old_ms = await timed(old)
+        new_winners, new_ms = await timed(new)
+        print(f"{name:<12}{old_ms:>14.1f}{new_ms:>16.1f}")
+        if name == 'first' and old_winners != new_winners:
+            print('  внимание: результаты first различаются')
+
+    await db.close()
+    os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--participants', type=int, default=100_000)
+    parser.add_argument('--winners', type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
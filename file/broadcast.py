@@ -0,0 +1,165 @@
+# broadcast.py (рассылка рекламы всем пользователям бота)
+
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from rate_limit import PRIORITY_BULK, request_priority
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_CHUNK_SIZE = 1000
+BROADCAST_CONCURRENCY = 32
+
+# Аренда рассылок при нескольких экземплярах бота: срок и период продления (сек)
+BROADCAST_LEASE_TTL = 30.0
+BROADCAST_LEASE_HEARTBEAT = 10.0
+
+
+class AdBroadcaster:
+    '''Потоковая рассылка объявлений из ads всем пользователям.
+
+    Получатели читаются из users пачками по user_id, отправка идет
+    параллельно (не более concurrency запросов) через общий планировщик
+    запросов бота с наименьшим приоритетом. После каждой пачки одной
+    транзакцией пишутся отправки, просмотры и контрольная точка в
+    ad_broadcasts, поэтому после перезапуска рассылка продолжается с
+    последней пачки (ее получатели могут получить сообщение повторно).
+
+    С instance_id (несколько экземпляров на одной БД) рассылку ведет только
+    арендовавший ее в ad_broadcasts экземпляр; рассылки остановившегося
+    экземпляра подхватывают остальные.
+    '''
+
+    def __init__(self, bot, db, chunk_size: int = BROADCAST_CHUNK_SIZE,
+                 concurrency: int = BROADCAST_CONCURRENCY, instance_id: Optional[str] = None,
+                 lease_ttl: float = BROADCAST_LEASE_TTL, lease_heartbeat: float = BROADCAST_LEASE_HEARTBEAT):
+        self.bot = bot
+        self.db = db
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.instance_id = instance_id
+        self.lease_ttl = lease_ttl
+        self.lease_heartbeat = lease_heartbeat
+        self._tasks: Dict[int, asyncio.Task] = {}  # ad_id -> задача рассылки
+        self._lease_task: Optional[asyncio.Task] = None
+
+    async def start(self, ad_id: int) -> bool:
+        '''Запуск рассылки объявления с начала; False, если она уже идет или объявления нет'''
+        if ad_id in self._tasks or await self.db.get_ad(ad_id) is None:
+            return False
+        if not await self.db.start_ad_broadcast(ad_id, self.instance_id, self.lease_ttl):
+            return False
+        self._spawn(ad_id)
+        self._ensure_lease_heartbeat()
+        return True
+
+    async def resume(self) -> int:
+        '''Продолжение незавершенных рассылок после перезапуска (при нескольких экземплярах — только арендованных)'''
+        if self.instance_id is None:
+            ad_ids = await self.db.get_running_ad_broadcasts()
+            for ad_id in ad_ids:
+                if ad_id not in self._tasks:
+                    self._spawn(ad_id)
+        else:
+            ad_ids = await self._sync_leases()
+            self._ensure_lease_heartbeat()
+        if ad_ids:
+            logger.info(f"Продолжены рассылки рекламы: {ad_ids}")
+        return len(ad_ids)
+
+    def _ensure_lease_heartbeat(self):
+        if self.instance_id is not None and (self._lease_task is None or self._lease_task.done()):
+            self._lease_task = asyncio.create_task(self._lease_heartbeat())
+
+    async def _lease_heartbeat(self):
+        '''Фоновое продление аренд и подхват рассылок остановившихся экземпляров'''
+        while True:
+            await asyncio.sleep(self.lease_heartbeat)
+            try:
+                acquired = await self._sync_leases()
+                if acquired:
+                    logger.info(f"Подхвачены рассылки рекламы: {acquired}")
+            except Exception as e:
+                logger.error(f"Ошибка продления аренды рассылок: {e}")
+
+    async def _sync_leases(self):
+        '''Продление и захват аренд; возвращает ID рассылок, запущенных этим вызовом'''
+        owned = set(await self.db.claim_ad_broadcasts(self.instance_id, self.lease_ttl))
+        for ad_id in list(self._tasks):
+            if ad_id not in owned:
+                # Отменена или перешла другому экземпляру
+                logger.warning(f"Рассылка рекламы #{ad_id} больше не за этим экземпляром")
+                self._tasks.pop(ad_id).cancel()
+        acquired = [ad_id for ad_id in owned if ad_id not in self._tasks]
+        for ad_id in acquired:
+            self._spawn(ad_id)
+        return acquired
+
+    async def cancel(self, ad_id: int):
+        '''Остановка рассылки без возможности продолжения'''
+        task = self._tasks.pop(ad_id, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.db.finish_ad_broadcast(ad_id, 'cancelled')
+
+    async def close(self):
+        '''Остановка задач; статус running остается, рассылки продолжатся при следующем запуске'''
+        if self._lease_task is not None:
+            self._lease_task.cancel()
+            self._lease_task = None
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.instance_id is not None:
+            # Отдаем рассылки другим экземплярам сразу, не дожидаясь истечения аренды
+            await self.db.release_ad_broadcasts(self.instance_id)
+
+    def _spawn(self, ad_id: int):
+        self._tasks[ad_id] = asyncio.create_task(self._run(ad_id))
+
+    async def _run(self, ad_id: int):
+        request_priority.set(PRIORITY_BULK)
+        try:
+            ad = await self.db.get_ad(ad_id)
+            state = await self.db.get_ad_broadcast(ad_id)
+            if ad is None or state is None:
+                await self.db.finish_ad_broadcast(ad_id, 'cancelled')
+                return
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def deliver(user_id: int) -> Optional[int]:
+                async with semaphore:
+                    try:
+                        await self.bot.send_message(user_id, ad['text'])
+                        return user_id
+                    except Exception as e:
+                        # Обычно пользователь заблокировал бота: считаем и идем дальше
+                        logger.debug(f"Реклама #{ad_id} не доставлена {user_id}: {e}")
+                        return None
+
+            sent, failed = state['sent'], state['failed']
+            async for chunk in self.db.iter_user_chunks(self.chunk_size, state['last_user_id']):
+                results = await asyncio.gather(*(deliver(row[0]) for row in chunk))
+                delivered = [user_id for user_id in results if user_id is not None]
+                if not await self.db.record_ad_broadcast_chunk(
+                    ad_id, delivered, chunk[-1][0], len(results) - len(delivered), self.instance_id
+                ):
+                    logger.warning(f"Рассылка рекламы #{ad_id} остановлена: отменена или перешла другому экземпляру")
+                    return
+                sent += len(delivered)
+                failed += len(results) - len(delivered)
+
+            await self.db.finish_ad_broadcast(ad_id)
+            logger.info(f"Рассылка рекламы #{ad_id} завершена: доставлено {sent}, ошибок {failed}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка рассылки рекламы #{ad_id}: {e}")
+        finally:
+            if self._tasks.get(ad_id) is asyncio.current_task():
+                del self._tasks[ad_id]
@@ -0,0 +1,53 @@
+# commissions.py (расчет эффективной комиссии розыгрыша с кэшем)
+
+from collections import OrderedDict
+from typing import Dict, Optional
+
+CACHE_SIZE = 4096
+
+
+class CommissionResolver:
+    '''Эффективная комиссия для пары (цель розыгрыша, создатель).
+
+    Приоритет: комиссия создателя (user_commissions) > комиссия чата
+    (chat_commissions) > комиссия канала/чата из channels > глобальная.
+    Результаты хранятся в ограниченном LRU-кэше и сбрасываются методами
+    set_*_commission базы, поэтому отрисовка розыгрыша не обращается к SQLite.
+    '''
+
+    def __init__(self, db, max_size: int = CACHE_SIZE):
+        self.db = db
+        self.max_size = max_size
+        self._cache: OrderedDict = OrderedDict()
+        # Счетчик сбросов: значение, загруженное до сброса, не попадает в кэш
+        self._generation = 0
+
+    async def resolve(self, target_type: str, target_id: str, creator_id: Optional[int] = None) -> Dict:
+        '''Комиссия в виде {'value': ..., 'type': 'percent' | 'fixed'}'''
+        key = (target_type, str(target_id), creator_id)
+        info = self._cache.get(key)
+        if info is not None:
+            self._cache.move_to_end(key)
+            return info
+
+        generation = self._generation
+        info = await self.db.get_effective_commission(target_type, str(target_id), creator_id)
+        if generation == self._generation:
+            self._cache[key] = info
+            if len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return info
+
+    def invalidate(self, target_id: Optional[str] = None, creator_id: Optional[int] = None):
+        '''Сброс кэша: полностью (без аргументов), по цели или по создателю'''
+        self._generation += 1
+        if target_id is None and creator_id is None:
+            self._cache.clear()
+            return
+        stale = [
+            key for key in self._cache
+            if (target_id is not None and key[1] == str(target_id))
+            or (creator_id is not None and key[2] == creator_id)
+        ]
+        for key in stale:
+            del self._cache[key]
@@ -1,8 +1,39 @@
 import os
 from dotenv import load_dotenv
 
+import giveaway_system
+import join_pipeline
+
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "8245541977:AAGhAZHg0GOLZtneG040-_TZfuNktCte4rI")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "6810310065"))
-DATABASE_PATH = "giveaway_bot.db"
\ No newline at end of file
+DATABASE_PATH = "giveaway_bot.db"
+
+# Минимальный интервал между правками сообщения розыгрыша, сек
+MESSAGE_EDIT_INTERVAL = float(os.getenv("MESSAGE_EDIT_INTERVAL", giveaway_system.MESSAGE_EDIT_INTERVAL))
+
+# Очередь заявок на участие: число обработчиков и максимальная длина
+JOIN_WORKERS = int(os.getenv("JOIN_WORKERS", join_pipeline.JOIN_WORKERS))
+JOIN_QUEUE_SIZE = int(os.getenv("JOIN_QUEUE_SIZE", join_pipeline.JOIN_QUEUE_SIZE))
+
+# Сохранять копии фото розыгрышей в giveaway_photos (публикация все равно идет по file_id)
+ARCHIVE_GIVEAWAY_PHOTOS = os.getenv("ARCHIVE_GIVEAWAY_PHOTOS", "0") == "1"
+
+# Несколько процессов бота на одной БД: таймеры и выплаты розыгрыша ведет владелец аренды
+MULTI_INSTANCE = os.getenv("MULTI_INSTANCE", "0") == "1"
+
+# Режим приема обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Вебхук: адрес и порт aiohttp-сервера, путь, публичный URL (без пути) и секрет,
+# который Telegram присылает в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Свой сервер Bot API (локальный telegram-bot-api или тестовый стенд) и общий лимит сообщений в секунду
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
\ No newline at end of file
@@ -1,209 +1,329 @@
 # database.py (обновленная версия: добавлены поля chat_type и added_by в таблицу channels, миграция для существующих таблиц, заглушки для методов, get_giveaway_participants, обновлен add_channel)
 
+import asyncio
+import logging
+import time
 import aiosqlite
+from contextlib import asynccontextmanager
 from datetime import datetime
+from migrations import MIGRATIONS, LATEST_VERSION
+from commissions import CommissionResolver
+
+logger = logging.getLogger(__name__)
 
 DATABASE_PATH = "giveaway_bot.db"
 
+# Настройки соединений: один писатель и пул читателей (WAL позволяет читать параллельно с записью)
+READER_POOL_SIZE = 4
+CACHED_STATEMENTS = 256
+CONNECTION_PRAGMAS = (
+    'PRAGMA cache_size = -16000',  # ~16 МБ страничного кэша на соединение
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 5000',
+)
+WRITER_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+)
+
+# Настройки отложенной (пакетной) записи участников
+JOIN_FLUSH_INTERVAL = 0.05  # секунд между фиксациями пакета
+JOIN_BATCH_SIZE = 500  # максимум строк в одной транзакции
+JOIN_WRITE_RETRIES = 3  # повторов пакета при ошибке записи
+JOIN_RETRY_DELAY = 0.5  # секунд перед первым повтором (далее удваивается)
+
+# Размер страницы для потоковых обходов таблиц
+STREAM_CHUNK_SIZE = 1000
+# Размер пачки ID в запросах WHERE ... IN (...) (ниже лимита параметров SQLite)
+USERNAME_BATCH_SIZE = 500
+
 class Database:
-    def __init__(self, db_path=DATABASE_PATH):
+    def __init__(self, db_path=DATABASE_PATH, readers: int = READER_POOL_SIZE,
+                 join_flush_interval: float = JOIN_FLUSH_INTERVAL, join_batch_size: int = JOIN_BATCH_SIZE):
         self.db_path = db_path
-    
-    async def init_db(self):
-        '''Инициализация базы данных'''
-        async with aiosqlite.connect(self.db_path) as db:
-            # Таблица пользователей
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    balance REAL DEFAULT 0,
-                    giveaways_won INTEGER DEFAULT 0,
-                    giveaways_participated INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Таблица админов
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS admins (
-                    user_id INTEGER PRIMARY KEY,
-                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Таблица каналов (с полями chat_type и added_by)
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS channels (
-                    channel_id TEXT PRIMARY KEY,
-                    channel_name TEXT,
-                    commission REAL DEFAULT 5.0,
-                    commission_type TEXT DEFAULT 'percent',
-                    active INTEGER DEFAULT 1,
-                    chat_type TEXT DEFAULT 'channel',
-                    added_by INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Таблица комиссий для чатов
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS chat_commissions (
-                    chat_id TEXT PRIMARY KEY,
-                    value REAL DEFAULT 5.0,
-                    commission_type TEXT DEFAULT 'percent'
-                )
-            ''')
-            
-            # Таблица комиссий для пользователей
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS user_commissions (
-                    user_id INTEGER PRIMARY KEY,
-                    value REAL DEFAULT 5.0,
-                    commission_type TEXT DEFAULT 'percent'
-                )
-            ''')
-            
-            # Таблица избранных
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS favorites (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    type TEXT,
-                    entity_id TEXT,
-                    name TEXT
-                )
-            ''')
-            
-            # Таблица розыгрышей
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS giveaways (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    creator_id INTEGER,
-                    prize_amount REAL,
-                    currency TEXT,
-                    winners_count INTEGER,
-                    strategy TEXT,
-                    delay_minutes INTEGER,
-                    status TEXT DEFAULT 'active',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    finished_at TIMESTAMP
-                )
-            ''')
-            
-            # Миграция для creator_id в таблице giveaways
-            async with db.execute("PRAGMA table_info(giveaways)") as cursor:
-                columns = await cursor.fetchall()
-                column_names = [col[1] for col in columns]
-                if 'creator_id' not in column_names:
-                    await db.execute("ALTER TABLE giveaways ADD COLUMN creator_id INTEGER")
-            
-            # Таблица участников розыгрышей
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS participants (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    giveaway_id INTEGER,
-                    user_id INTEGER,
-                    is_winner INTEGER DEFAULT 0,
-                    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (giveaway_id) REFERENCES giveaways(id),
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            ''')
-            
-            # Таблица рекламы
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS ads (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    text TEXT,
-                    views INTEGER DEFAULT 0,
-                    active INTEGER DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Таблица отправок рекламы
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS ad_deliveries (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ad_id INTEGER,
-                    user_id INTEGER,
-                    sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (ad_id) REFERENCES ads(id),
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            ''')
-            
-            # Таблица транзакций
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    amount REAL,
-                    type TEXT,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            ''')
-            
-            # Таблица глобальной комиссии
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS global_commission (
-                    id INTEGER PRIMARY KEY DEFAULT 1,
-                    value REAL DEFAULT 5.0,
-                    commission_type TEXT DEFAULT 'percent'
+        self.readers = readers
+        self._writer_conn = None
+        self._writer_lock = asyncio.Lock()
+        self._readers: asyncio.Queue = None
+        self._reader_conns = []
+        self._pool_lock = asyncio.Lock()
+        self.join_flush_interval = join_flush_interval
+        self.join_batch_size = join_batch_size
+        self._join_queue: asyncio.Queue = None
+        self._join_task: asyncio.Task = None
+        self._admin_ids: set = None
+        self._cache_versions: dict = None  # версии cache_versions на момент последней сверки
+        self.commissions = CommissionResolver(self)
+
+    # === СОЕДИНЕНИЯ ===
+    async def _open_connection(self, read_only: bool = False):
+        '''Открытие постоянного соединения с настроенными PRAGMA'''
+        if read_only:
+            conn = await aiosqlite.connect(
+                f'file:{self.db_path}?mode=ro', uri=True, cached_statements=CACHED_STATEMENTS
+            )
+        else:
+            conn = await aiosqlite.connect(self.db_path, cached_statements=CACHED_STATEMENTS)
+        conn.row_factory = aiosqlite.Row
+        for pragma in CONNECTION_PRAGMAS + (() if read_only else WRITER_PRAGMAS):
+            await conn.execute(pragma)
+        return conn
+
+    async def _ensure_pool(self):
+        '''Ленивое открытие писателя и читателей при первом обращении'''
+        if self._readers is not None:
+            return
+        async with self._pool_lock:
+            if self._readers is not None:
+                return
+            # Писатель первым создает файл БД и включает WAL
+            self._writer_conn = await self._open_connection()
+            readers = asyncio.Queue()
+            for _ in range(self.readers):
+                conn = await self._open_connection(read_only=True)
+                self._reader_conns.append(conn)
+                readers.put_nowait(conn)
+            self._readers = readers
+
+    @asynccontextmanager
+    async def _writer(self):
+        '''Единственное соединение для записи, выдается эксклюзивно на одну операцию'''
+        await self._ensure_pool()
+        async with self._writer_lock:
+            conn = self._writer_conn
+            try:
+                yield conn
+            except BaseException:
+                # Не оставляем на писателе незавершенную транзакцию
+                if conn.in_transaction:
+                    await conn.rollback()
+                raise
+
+    @asynccontextmanager
+    async def _reader(self):
+        '''Соединение только для чтения из пула; чтения не ждут писателя'''
+        await self._ensure_pool()
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    async def close(self):
+        '''Сброс очереди участников и закрытие всех соединений'''
+        await self._stop_join_writer()
+        async with self._pool_lock:
+            if self._readers is None:
+                return
+            for _ in range(len(self._reader_conns)):
+                await self._readers.get()
+            for conn in self._reader_conns:
+                await conn.close()
+            async with self._writer_lock:
+                await self._writer_conn.close()
+            self._reader_conns = []
+            self._readers = None
+            self._writer_conn = None
+
+    # === ОТЛОЖЕННАЯ ЗАПИСЬ УЧАСТНИКОВ ===
+    def enqueue_participant(self, giveaway_id: int, user_id: int) -> asyncio.Future:
+        '''Постановка участия в очередь пакетной записи.
+
+        Возвращает future, который после фиксации пакета в БД завершается
+        True (участник добавлен), False (уже участвовал) или None, если
+        запись не удалась и после повторов.
+        '''
+        return self._enqueue_join((giveaway_id, user_id))
+
+    async def flush_joins(self):
+        '''Ожидание фиксации всех участников, поставленных в очередь ранее'''
+        if self._join_task is None:
+            return
+        await self._enqueue_join(None)
+
+    def _enqueue_join(self, row) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        if self._join_task is None:
+            self._join_queue = asyncio.Queue()
+            self._join_task = loop.create_task(self._join_writer())
+        future = loop.create_future()
+        self._join_queue.put_nowait((row, future))
+        return future
+
+    async def _join_writer(self):
+        '''Фоновая задача: собирает пакеты по времени/размеру и пишет их одной транзакцией'''
+        queue = self._join_queue
+        stopping = False
+        while not stopping:
+            batch = [await queue.get()]
+            # Копим пакет в течение окна, если он еще не набран; барьер (row=None) фиксирует сразу
+            if batch[0][0] is not None and queue.qsize() < self.join_batch_size - 1:
+                await asyncio.sleep(self.join_flush_interval)
+            while batch[-1][0] is not None and len(batch) < self.join_batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            stopping = any(future is None for _, future in batch)
+            await self._flush_join_batch(batch)
+
+    async def _flush_join_batch(self, batch):
+        rows = [row for row, _ in batch if row is not None]
+        inserted = []
+        failed = False
+        delay = JOIN_RETRY_DELAY
+        for attempt in range(JOIN_WRITE_RETRIES + 1):
+            if not rows:
+                break
+            try:
+                inserted = await self._write_join_rows(rows)
+                break
+            except Exception as e:
+                if attempt == JOIN_WRITE_RETRIES:
+                    dropped = ', '.join(f"{gid}:{uid}" for gid, uid in rows)
+                    logger.error(f"Не удалось записать {len(rows)} участников (розыгрыш:пользователь): {dropped}: {e}")
+                    failed = True
+                    break
+                logger.warning(f"Ошибка пакетной записи {len(rows)} участников, повтор через {delay} с: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+        results = iter(inserted)
+        for row, future in batch:
+            if row is None:
+                result = True
+            else:
+                result = None if failed else next(results)
+            if future is not None and not future.done():
+                future.set_result(result)
+
+    async def _write_join_rows(self, rows) -> list:
+        '''Запись пакета участников одной транзакцией; для каждой строки — была ли она добавлена'''
+        inserted = []
+        async with self._writer() as db:
+            for row in rows:
+                cursor = await db.execute(
+                    'INSERT OR IGNORE INTO participants (giveaway_id, user_id) VALUES (?, ?)', row
                 )
-            ''')
-            
-            # Убедимся, что глобальная комиссия существует
-            await db.execute('INSERT OR IGNORE INTO global_commission (id) VALUES (1)')
-            
+                # Дубликат (уже участвует) не вставляется и не увеличивает счетчик
+                inserted.append(cursor.rowcount > 0)
+            await db.executemany(
+                'UPDATE users SET giveaways_participated = giveaways_participated + 1 WHERE user_id = ?',
+                [(user_id,) for (_, user_id), added in zip(rows, inserted) if added]
+            )
             await db.commit()
-    
-    async def update_channels_table(self):
-        '''Миграция таблицы channels: добавление полей chat_type и added_by, если их нет'''
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("PRAGMA table_info(channels)") as cursor:
-                columns = await cursor.fetchall()
-                column_names = [col[1] for col in columns]
-                
-                if 'chat_type' not in column_names:
-                    await db.execute("ALTER TABLE channels ADD COLUMN chat_type TEXT DEFAULT 'channel'")
-                
-                if 'added_by' not in column_names:
-                    await db.execute("ALTER TABLE channels ADD COLUMN added_by INTEGER")
-                
+        return inserted
+
+    async def _stop_join_writer(self):
+        '''Сброс оставшихся участников на диск и остановка фоновой задачи'''
+        if self._join_task is None:
+            return
+        self._join_queue.put_nowait((None, None))
+        await self._join_task
+        self._join_task = None
+        self._join_queue = None
+
+    async def _iter_keyset(self, sql: str, start, chunk_size: int, params: tuple = ()):
+        '''Постраничный обход по ключу (первая колонка): sql принимает (*params, последний_ключ, лимит).
+
+        Соединение берется из пула только на время чтения одной страницы,
+        поэтому долгий обход не занимает его между страницами.
+        '''
+        last_key = start
+        while True:
+            async with self._reader() as db:
+                async with db.execute(sql, (*params, last_key, chunk_size)) as cursor:
+                    cursor.row_factory = None
+                    rows = await cursor.fetchall()
+            if not rows:
+                return
+            yield rows
+            if len(rows) < chunk_size:
+                return
+            last_key = rows[-1][0]
+
+    # === СХЕМА ===
+    async def migrate(self) -> int:
+        '''Применение недостающих миграций схемы одной транзакцией'''
+        async with self._writer() as db:
+            version = await self._schema_version(db)
+            if version >= LATEST_VERSION:
+                return version
+
+            # Повторная проверка под блокировкой записи: другой процесс мог успеть раньше
+            await db.execute('BEGIN IMMEDIATE')
+            version = await self._schema_version(db)
+            for number, description, step in MIGRATIONS:
+                if number <= version:
+                    continue
+                logger.info(f"Миграция схемы до версии {number}: {description}")
+                await step(db)
+                version = number
+            await db.execute(f'PRAGMA user_version = {version}')
             await db.commit()
-    
+            return version
+
+    @staticmethod
+    async def _schema_version(db) -> int:
+        async with db.execute('PRAGMA user_version') as cursor:
+            return (await cursor.fetchone())[0]
+
     # === ПОЛЬЗОВАТЕЛИ ===
     async def add_user(self, user_id: int, username: str = None):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
+        async with self._writer() as db:
+            cursor = await db.execute(
                 'INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)',
                 (user_id, username)
             )
+            if cursor.rowcount:
+                await self._bump_stats(db, users=1)
             await db.commit()
     
     async def get_user(self, user_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._reader() as db:
             async with db.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)) as cursor:
                 return await cursor.fetchone()
     
+    async def get_usernames(self, user_ids) -> dict:
+        '''Известные username пользователей одним запросом на пачку: {user_id: username}'''
+        user_ids = list(user_ids)
+        usernames = {}
+        async with self._reader() as db:
+            for i in range(0, len(user_ids), USERNAME_BATCH_SIZE):
+                batch = user_ids[i:i + USERNAME_BATCH_SIZE]
+                placeholders = ', '.join('?' * len(batch))
+                async with db.execute(
+                    f'SELECT user_id, username FROM users '
+                    f'WHERE user_id IN ({placeholders}) AND username IS NOT NULL',
+                    batch
+                ) as cursor:
+                    cursor.row_factory = None
+                    usernames.update(await cursor.fetchall())
+        return usernames
+    
     async def get_all_users(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._reader() as db:
             async with db.execute('SELECT * FROM users') as cursor:
                 return await cursor.fetchall()
     
+    async def iter_user_chunks(self, chunk_size: int = STREAM_CHUNK_SIZE, after_user_id: int = 0):
+        '''Потоковый обход пользователей страницами кортежей (user_id, username, balance)'''
+        async for chunk in self._iter_keyset(
+            'SELECT user_id, username, balance FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?',
+            after_user_id, chunk_size
+        ):
+            yield chunk
+    
+    async def iter_users(self, chunk_size: int = STREAM_CHUNK_SIZE, after_user_id: int = 0):
+        '''Потоковый обход пользователей по одному кортежу (user_id, username, balance)'''
+        async for chunk in self.iter_user_chunks(chunk_size, after_user_id):
+            for row in chunk:
+                yield row
+    
     async def get_all_users_count(self):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._reader() as db:
             async with db.execute('SELECT COUNT(*) FROM users') as cursor:
                 result = await cursor.fetchone()
                 return result[0]
     
     async def update_balance(self, user_id: int, amount: float):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute(
                 'UPDATE users SET balance = balance + ? WHERE user_id = ?',
                 (amount, user_id)
@@ -211,7 +331,7 @@ class Database:
             await db.commit()
     
     async def increment_participation(self, user_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute(
                 'UPDATE users SET giveaways_participated = giveaways_participated + 1 WHERE user_id = ?',
                 (user_id,)
@@ -219,7 +339,7 @@ class Database:
             await db.commit()
     
     async def increment_wins(self, user_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute(
                 'UPDATE users SET giveaways_won = giveaways_won + 1 WHERE user_id = ?',
                 (user_id,)
@@ -228,79 +348,146 @@ class Database:
     
     # === АДМИНЫ ===
     async def add_admin(self, user_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute(
                 'INSERT OR IGNORE INTO admins (user_id) VALUES (?)',
                 (user_id,)
             )
+            await self._bump_cache_version(db, 'admins')
             await db.commit()
+        if self._admin_ids is not None:
+            self._admin_ids.add(user_id)
     
     async def get_all_admins(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._reader() as db:
             async with db.execute('SELECT * FROM admins') as cursor:
                 return await cursor.fetchall()
     
+    async def is_admin(self, user_id: int) -> bool:
+        '''Проверка админа по множеству ID в памяти (загружается один раз)'''
+        if self._admin_ids is None:
+            async with self._reader() as db:
+                async with db.execute('SELECT user_id FROM admins') as cursor:
+                    self._admin_ids = {row[0] for row in await cursor.fetchall()}
+        return user_id in self._admin_ids
+    
     async def remove_admin(self, user_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute('DELETE FROM admins WHERE user_id = ?', (user_id,))
+            await self._bump_cache_version(db, 'admins')
             await db.commit()
+        if self._admin_ids is not None:
+            self._admin_ids.discard(user_id)
     
     # === КАНАЛЫ ===
     async def add_channel(self, channel_id: str, channel_name: str, chat_type: str = 'channel', added_by: int = None):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute(
                 'INSERT OR REPLACE INTO channels (channel_id, channel_name, chat_type, added_by) VALUES (?, ?, ?, ?)',
                 (channel_id, channel_name, chat_type, added_by)
             )
+            await self._bump_cache_version(db, 'commissions')
             await db.commit()
+        self.commissions.invalidate(target_id=channel_id)
     
     async def get_channel(self, channel_id: str):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._reader() as db:
             async with db.execute('SELECT * FROM channels WHERE channel_id = ?', (channel_id,)) as cursor:
                 return await cursor.fetchone()
     
     async def get_all_channels(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._reader() as db:
             async with db.execute('SELECT * FROM channels') as cursor:
                 return await cursor.fetchall()
     
+    async def iter_channels(self, chunk_size: int = STREAM_CHUNK_SIZE):
+        '''Потоковый обход каналов: (channel_id, channel_name, chat_type, commission, commission_type)'''
+        async for chunk in self._iter_keyset(
+            'SELECT channel_id, channel_name, chat_type, commission, commission_type FROM channels '
+            'WHERE channel_id > ? ORDER BY channel_id LIMIT ?',
+            '', chunk_size
+        ):
+            for row in chunk:
+                yield row
+    
     async def delete_channel(self, channel_id: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute('DELETE FROM channels WHERE channel_id = ?', (channel_id,))
+            await self._bump_cache_version(db, 'commissions')
             await db.commit()
+        self.commissions.invalidate(target_id=channel_id)
     
     # === КОМИССИИ ===
     async def set_global_commission(self, value: float, commission_type: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute(
                 'UPDATE global_commission SET value = ?, commission_type = ? WHERE id = 1',
                 (value, commission_type)
             )
+            await self._bump_cache_version(db, 'commissions')
             await db.commit()
+        self.commissions.invalidate()
     
     async def get_global_commission(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._reader() as db:
             async with db.execute('SELECT * FROM global_commission WHERE id = 1') as cursor:
                 return await cursor.fetchone()
     
     async def set_user_commission(self, user_id: int, value: float, commission_type: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute(
                 'INSERT OR REPLACE INTO user_commissions (user_id, value, commission_type) VALUES (?, ?, ?)',
                 (user_id, value, commission_type)
             )
+            await self._bump_cache_version(db, 'commissions')
             await db.commit()
+        self.commissions.invalidate(creator_id=user_id)
     
     async def get_user_commission(self, user_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._reader() as db:
             async with db.execute('SELECT * FROM user_commissions WHERE user_id = ?', (user_id,)) as cursor:
                 return await cursor.fetchone()
     
+    async def set_chat_commission(self, chat_id: str, value: float, commission_type: str):
+        async with self._writer() as db:
+            await db.execute(
+                'INSERT OR REPLACE INTO chat_commissions (chat_id, value, commission_type) VALUES (?, ?, ?)',
+                (chat_id, value, commission_type)
+            )
+            await self._bump_cache_version(db, 'commissions')
+            await db.commit()
+        self.commissions.invalidate(target_id=chat_id)
+    
+    async def set_channel_commission(self, channel_id: str, value: float, commission_type: str):
+        async with self._writer() as db:
+            await db.execute(
+                'UPDATE channels SET commission = ?, commission_type = ? WHERE channel_id = ?',
+                (value, commission_type, channel_id)
+            )
+            await self._bump_cache_version(db, 'commissions')
+            await db.commit()
+        self.commissions.invalidate(target_id=channel_id)
+    
+    async def get_effective_commission(self, target_type: str, target_id: str, creator_id: int = None):
+        '''Комиссия с учетом приоритета: создатель > чат > канал > глобальная (один запрос)'''
+        async with self._reader() as db:
+            async with db.execute('''
+                SELECT value, commission_type FROM (
+                    SELECT 1 AS priority, value, commission_type FROM user_commissions WHERE user_id = ?
+                    UNION ALL
+                    SELECT 2, value, commission_type FROM chat_commissions WHERE chat_id = ? AND ? = 'chat'
+                    UNION ALL
+                    SELECT 3, commission, commission_type FROM channels
+                    WHERE channel_id = ? AND commission IS NOT NULL
+                    UNION ALL
+                    SELECT 4, value, commission_type FROM global_commission WHERE id = 1
+                ) ORDER BY priority LIMIT 1
+            ''', (creator_id, target_id, target_type, target_id)) as cursor:
+                row = await cursor.fetchone()
+        if row is None:
+            return {'value': 5.0, 'type': 'percent'}
+        return {'value': row['value'], 'type': row['commission_type'] or 'percent'}
+    
     async def get_all_commissions(self):
         # Заглушка: возвращает пустой список, реализуйте по необходимости
         return []
@@ -325,23 +512,23 @@ class Database:
     # === РОЗЫГРЫШИ ===
     async def create_giveaway(self, creator_id: int, prize_amount: float, currency: str,
                               winners_count: int, strategy: str, delay_minutes: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             cursor = await db.execute(
                 'INSERT INTO giveaways (creator_id, prize_amount, currency, winners_count, strategy, delay_minutes) '
                 'VALUES (?, ?, ?, ?, ?, ?)',
                 (creator_id, prize_amount, currency, winners_count, strategy, delay_minutes)
             )
+            await self._bump_stats(db, giveaways=1, processed=prize_amount)
             await db.commit()
             return cursor.lastrowid
     
     async def get_giveaway(self, giveaway_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._reader() as db:
             async with db.execute('SELECT * FROM giveaways WHERE id = ?', (giveaway_id,)) as cursor:
                 return await cursor.fetchone()
     
     async def finish_giveaway(self, giveaway_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute(
                 'UPDATE giveaways SET status = "finished", finished_at = CURRENT_TIMESTAMP WHERE id = ?',
                 (giveaway_id,)
@@ -349,7 +536,7 @@ class Database:
             await db.commit()
     
     async def add_participant(self, giveaway_id: int, user_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute(
                 'INSERT OR IGNORE INTO participants (giveaway_id, user_id) VALUES (?, ?)',
                 (giveaway_id, user_id)
@@ -357,12 +544,21 @@ class Database:
             await db.commit()
     
     async def get_participants(self, giveaway_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._reader() as db:
             async with db.execute('SELECT user_id FROM participants WHERE giveaway_id = ?', (giveaway_id,)) as cursor:
                 return [row[0] for row in await cursor.fetchall()]
     
+    async def iter_participant_chunks(self, giveaway_id: int, chunk_size: int = STREAM_CHUNK_SIZE):
+        '''Потоковый обход участников розыгрыша страницами user_id в порядке возрастания'''
+        async for chunk in self._iter_keyset(
+            'SELECT user_id FROM participants WHERE giveaway_id = ? AND user_id > ? '
+            'ORDER BY user_id LIMIT ?',
+            -1, chunk_size, (giveaway_id,)
+        ):
+            yield [row[0] for row in chunk]
+    
     async def set_winner(self, giveaway_id: int, user_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute(
                 'UPDATE participants SET is_winner = 1 WHERE giveaway_id = ? AND user_id = ?',
                 (giveaway_id, user_id)
@@ -370,8 +566,7 @@ class Database:
             await db.commit()
     
     async def get_giveaway_participants(self, giveaway_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._reader() as db:
             async with db.execute(
                 'SELECT u.user_id, u.username FROM participants p '
                 'JOIN users u ON p.user_id = u.user_id WHERE p.giveaway_id = ?',
@@ -381,7 +576,7 @@ class Database:
     
     # === РЕКЛАМА ===
     async def add_ad(self, text: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             cursor = await db.execute(
                 'INSERT INTO ads (text) VALUES (?)',
                 (text,)
@@ -389,47 +584,132 @@ class Database:
             await db.commit()
             return cursor.lastrowid
     
+    async def get_ad(self, ad_id: int):
+        async with self._reader() as db:
+            async with db.execute('SELECT * FROM ads WHERE id = ?', (ad_id,)) as cursor:
+                return await cursor.fetchone()
+    
     async def get_all_ads(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._reader() as db:
             async with db.execute('SELECT * FROM ads') as cursor:
                 return await cursor.fetchall()
     
     async def delete_ad(self, ad_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute('DELETE FROM ads WHERE id = ?', (ad_id,))
             await db.commit()
     
     async def increment_ad_views(self, ad_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute('UPDATE ads SET views = views + 1 WHERE id = ?', (ad_id,))
             await db.commit()
     
     async def record_ad_delivery(self, ad_id: int, user_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute('INSERT INTO ad_deliveries (ad_id, user_id) VALUES (?, ?)', (ad_id, user_id))
             await db.commit()
     
+    # === РАССЫЛКИ РЕКЛАМЫ ===
+    async def start_ad_broadcast(self, ad_id: int, owner: str = None, ttl: float = 0) -> bool:
+        '''Новая рассылка объявления с начала (с owner — сразу с арендой экземпляра); False, если она уже идет'''
+        expires_at = time.time() + ttl if owner is not None else None
+        async with self._writer() as db:
+            cursor = await db.execute(
+                "INSERT INTO ad_broadcasts (ad_id, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (ad_id) DO UPDATE SET last_user_id = 0, sent = 0, failed = 0, "
+                "status = 'running', started_at = CURRENT_TIMESTAMP, finished_at = NULL, "
+                "owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE status != 'running'",
+                (ad_id, owner, expires_at)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+    
+    async def get_ad_broadcast(self, ad_id: int):
+        async with self._reader() as db:
+            async with db.execute('SELECT * FROM ad_broadcasts WHERE ad_id = ?', (ad_id,)) as cursor:
+                return await cursor.fetchone()
+    
+    async def get_running_ad_broadcasts(self):
+        '''ID объявлений с незавершенной рассылкой'''
+        async with self._reader() as db:
+            async with db.execute("SELECT ad_id FROM ad_broadcasts WHERE status = 'running'") as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+    
+    async def record_ad_broadcast_chunk(self, ad_id: int, delivered, last_user_id: int, failed: int,
+                                        owner: str = None) -> bool:
+        '''Итог пачки рассылки одной транзакцией: отправки, просмотры и контрольная точка.
+
+        False (ничего не записано), если рассылка уже не идет или ее аренда
+        перешла другому экземпляру (с owner).
+        '''
+        delivered = list(delivered)
+        sql = (
+            "UPDATE ad_broadcasts SET last_user_id = ?, sent = sent + ?, failed = failed + ? "
+            "WHERE ad_id = ? AND status = 'running'"
+        )
+        params = (last_user_id, len(delivered), failed, ad_id)
+        if owner is not None:
+            sql += ' AND owner = ?'
+            params += (owner,)
+        async with self._writer() as db:
+            cursor = await db.execute(sql, params)
+            if not cursor.rowcount:
+                await db.rollback()
+                return False
+            if delivered:
+                await db.executemany(
+                    'INSERT INTO ad_deliveries (ad_id, user_id) VALUES (?, ?)',
+                    [(ad_id, user_id) for user_id in delivered]
+                )
+                await db.execute('UPDATE ads SET views = views + ? WHERE id = ?', (len(delivered), ad_id))
+            await db.commit()
+            return True
+    
+    async def finish_ad_broadcast(self, ad_id: int, status: str = 'finished'):
+        async with self._writer() as db:
+            await db.execute(
+                'UPDATE ad_broadcasts SET status = ?, finished_at = CURRENT_TIMESTAMP, owner = NULL WHERE ad_id = ?',
+                (status, ad_id)
+            )
+            await db.commit()
+    
+    async def claim_ad_broadcasts(self, owner: str, ttl: float):
+        '''Продление своих аренд незавершенных рассылок и захват свободных или просроченных; возвращает ID объявлений'''
+        now = time.time()
+        async with self._writer() as db:
+            await db.execute('BEGIN IMMEDIATE')
+            await db.execute(
+                "UPDATE ad_broadcasts SET owner = ?, expires_at = ? WHERE status = 'running' "
+                "AND (owner = ? OR owner IS NULL OR expires_at < ?)",
+                (owner, now + ttl, owner, now)
+            )
+            async with db.execute(
+                "SELECT ad_id FROM ad_broadcasts WHERE status = 'running' AND owner = ?", (owner,)
+            ) as cursor:
+                owned = [row[0] for row in await cursor.fetchall()]
+            await db.commit()
+            return owned
+    
+    async def release_ad_broadcasts(self, owner: str):
+        '''Освобождение аренд рассылок экземпляра (при штатной остановке)'''
+        async with self._writer() as db:
+            await db.execute('UPDATE ad_broadcasts SET owner = NULL, expires_at = NULL WHERE owner = ?', (owner,))
+            await db.commit()
+    
     # === СТАТИСТИКА ===
     async def get_stats(self, period: str):
+        '''Статистика по дневным агрегатам stats_daily (без сканирования основных таблиц)'''
         where_clause = ''
         if period == 'month':
-            where_clause = 'WHERE created_at >= date("now", "-1 month")'
+            where_clause = "WHERE day >= date('now', '-1 month')"
         
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(f'SELECT COUNT(*) FROM users {where_clause}') as cursor:
-                total_users = (await cursor.fetchone())[0]
-            
-            async with db.execute(f'SELECT COUNT(*) FROM giveaways {where_clause}') as cursor:
-                total_giveaways = (await cursor.fetchone())[0]
-            
-            async with db.execute(f'SELECT SUM(prize_amount) FROM giveaways {where_clause}') as cursor:
-                result = await cursor.fetchone()
-                total_processed = result[0] if result[0] is not None else 0
-            
-            async with db.execute(f'SELECT SUM(amount) FROM transactions WHERE type = "commission" {where_clause}') as cursor:
-                result = await cursor.fetchone()
-                commission_income = result[0] if result[0] is not None else 0
+        async with self._reader() as db:
+            async with db.execute(
+                'SELECT COALESCE(SUM(users), 0), COALESCE(SUM(giveaways), 0), '
+                f'COALESCE(SUM(processed), 0), COALESCE(SUM(commission), 0) FROM stats_daily {where_clause}'
+            ) as cursor:
+                total_users, total_giveaways, total_processed, commission_income = await cursor.fetchone()
             
             return {
                 'total_users': total_users,
@@ -438,108 +718,259 @@ class Database:
                 'commission_income': commission_income
             }
     
+    @staticmethod
+    async def _bump_cache_version(db, name: str):
+        '''Отметка об изменении данных, закэшированных в памяти (видна другим экземплярам)'''
+        await db.execute('UPDATE cache_versions SET version = version + 1 WHERE name = ?', (name,))
+
+    async def sync_caches(self):
+        '''Сброс кэшей админов и комиссий, если их данные изменил другой экземпляр бота'''
+        async with self._reader() as db:
+            async with db.execute('SELECT name, version FROM cache_versions') as cursor:
+                versions = {row[0]: row[1] for row in await cursor.fetchall()}
+        previous = self._cache_versions or {}
+        if versions.get('admins') != previous.get('admins'):
+            self._admin_ids = None
+        if versions.get('commissions') != previous.get('commissions'):
+            self.commissions.invalidate()
+        self._cache_versions = versions
+
+    @staticmethod
+    async def _bump_stats(db, users: int = 0, giveaways: int = 0, processed: float = 0, commission: float = 0):
+        '''Инкремент дневного агрегата в текущей транзакции вызывающего'''
+        await db.execute(
+            '''INSERT INTO stats_daily (day, users, giveaways, processed, commission)
+            VALUES (date('now'), ?, ?, ?, ?)
+            ON CONFLICT (day) DO UPDATE SET
+                users = users + excluded.users,
+                giveaways = giveaways + excluded.giveaways,
+                processed = processed + excluded.processed,
+                commission = commission + excluded.commission''',
+            (users, giveaways, processed, commission)
+        )
+    
     # === ТРАНЗАКЦИИ ===
     async def add_transaction(self, user_id: int, amount: float, type: str, description: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute(
                 'INSERT INTO transactions (user_id, amount, type, description) VALUES (?, ?, ?, ?)',
                 (user_id, amount, type, description)
             )
+            if type == 'commission':
+                await self._bump_stats(db, commission=amount)
             await db.commit()
     
     # === НОВЫЕ МЕТОДЫ ДЛЯ СИСТЕМЫ РОЗЫГРЫШЕЙ V2 ===
     
-    async def init_db_v2_tables(self):
-        """Инициализация новых таблиц для системы розыгрышей v2"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS giveaways_v2 (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    creator_id INTEGER,
-                    target_type TEXT,
-                    target_id TEXT,
-                    prize_amount REAL,
-                    currency TEXT,
-                    winners_count INTEGER,
-                    duration_minutes INTEGER,
-                    strategy TEXT,
-                    description TEXT,
-                    photo_path TEXT,
-                    message_id INTEGER,
-                    status TEXT DEFAULT 'active',
-                    cancel_reason TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    finished_at TIMESTAMP,
-                    FOREIGN KEY (creator_id) REFERENCES users(user_id)
-                )
-            ''')
-            await db.commit()
-
     async def create_giveaway_v2(self, creator_id: int, target_type: str, target_id: str,
                                  prize_amount: float, currency: str, winners_count: int,
                                  duration_minutes: int, strategy: str, description: str = None,
-                                 photo_path: str = None):
-        """Создание розыгрыша v2"""
-        async with aiosqlite.connect(self.db_path) as db:
+                                 photo_path: str = None, photo_file_id: str = None,
+                                 lease_owner: str = None, lease_ttl: float = 0):
+        """Создание розыгрыша v2 (с lease_owner — сразу с арендой этого экземпляра)"""
+        async with self._writer() as db:
             cursor = await db.execute(
                 '''INSERT INTO giveaways_v2 
                 (creator_id, target_type, target_id, prize_amount, currency, 
-                winners_count, duration_minutes, strategy, description, photo_path, status) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'active')''',
+                winners_count, duration_minutes, strategy, description, photo_path, photo_file_id, status) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'active')''',
                 (creator_id, target_type, target_id, prize_amount, currency,
-                 winners_count, duration_minutes, strategy, description, photo_path)
+                 winners_count, duration_minutes, strategy, description, photo_path, photo_file_id)
             )
+            giveaway_id = cursor.lastrowid
+            if lease_owner is not None:
+                # В одной транзакции: другой экземпляр не успеет захватить розыгрыш без поста
+                await db.execute(
+                    'INSERT INTO giveaway_leases (giveaway_id, owner, expires_at) VALUES (?, ?, ?)',
+                    (giveaway_id, lease_owner, time.time() + lease_ttl)
+                )
+            await self._bump_stats(db, giveaways=1, processed=prize_amount)
             await db.commit()
-            return cursor.lastrowid
+            return giveaway_id
 
-    async def update_giveaway_message_id(self, giveaway_id: int, message_id: int):
-        """Обновление ID сообщения розыгрыша"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('UPDATE giveaways_v2 SET message_id = ? WHERE id = ?',
-                           (message_id, giveaway_id))
+    async def update_giveaway_message_id(self, giveaway_id: int, message_id: int, photo_file_id: str = None):
+        """Обновление ID сообщения розыгрыша (и file_id фото из ответа Telegram)"""
+        async with self._writer() as db:
+            await db.execute(
+                'UPDATE giveaways_v2 SET message_id = ?, photo_file_id = COALESCE(?, photo_file_id) WHERE id = ?',
+                (message_id, photo_file_id, giveaway_id)
+            )
             await db.commit()
 
     async def get_participants_with_time(self, giveaway_id: int):
         """Получение участников с временем присоединения"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._reader() as db:
             async with db.execute(
                 'SELECT user_id, joined_at FROM participants WHERE giveaway_id = ? ORDER BY joined_at',
                 (giveaway_id,)
             ) as cursor:
                 return await cursor.fetchall()
 
+    async def get_first_participants(self, giveaway_id: int, limit: int):
+        """Первые limit участников по времени присоединения (при равенстве — по порядку записи)"""
+        async with self._reader() as db:
+            async with db.execute(
+                'SELECT user_id FROM participants WHERE giveaway_id = ? '
+                'ORDER BY joined_at, id LIMIT ?',
+                (giveaway_id, limit)
+            ) as cursor:
+                cursor.row_factory = None
+                return [row[0] for row in await cursor.fetchall()]
+
+    async def get_most_active_participants(self, giveaway_id: int, limit: int):
+        """limit участников с наибольшим числом участий; при равенстве выигрывает присоединившийся раньше"""
+        async with self._reader() as db:
+            async with db.execute(
+                'SELECT p.user_id FROM participants p '
+                'LEFT JOIN users u ON u.user_id = p.user_id '
+                'WHERE p.giveaway_id = ? '
+                'ORDER BY COALESCE(u.giveaways_participated, 0) DESC, p.joined_at, p.id LIMIT ?',
+                (giveaway_id, limit)
+            ) as cursor:
+                cursor.row_factory = None
+                return [row[0] for row in await cursor.fetchall()]
+
     async def get_chat_commission(self, chat_id: str):
         """Получение комиссии чата"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._reader() as db:
             async with db.execute('SELECT * FROM chat_commissions WHERE chat_id = ?',
                                 (chat_id,)) as cursor:
                 return await cursor.fetchone()
 
     async def cancel_giveaway(self, giveaway_id: int, reason: str):
         """Отмена розыгрыша"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._writer() as db:
             await db.execute(
                 "UPDATE giveaways_v2 SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP, cancel_reason = ? WHERE id = ?",
                 (reason, giveaway_id))
             await db.commit()
 
+    async def settle_giveaway(self, giveaway_id: int, winners, amount: float, commission: float,
+                              winner_seed: int = None) -> bool:
+        """Завершение розыгрыша v2 одной транзакцией.
+
+        Начисляет каждому победителю amount, пишет выигрыши и суммарную
+        комиссию commission в transactions, увеличивает счетчики побед,
+        отмечает победителей в participants и переводит розыгрыш в finished.
+        winner_seed сохраняется для проверки случайного выбора победителей.
+        Возвращает False, если розыгрыш уже не активен (ничего не меняется).
+        """
+        # Участники из очереди отложенной записи должны попасть в БД до отметки победителей
+        await self.flush_joins()
+        winners = list(winners)
+        description = f"Выигрыш в розыгрыше #{giveaway_id}"
+        async with self._writer() as db:
+            cursor = await db.execute(
+                "UPDATE giveaways_v2 SET status = 'finished', finished_at = CURRENT_TIMESTAMP, winner_seed = ? "
+                "WHERE id = ? AND status = 'active'",
+                (winner_seed, giveaway_id)
+            )
+            if cursor.rowcount == 0:
+                await db.rollback()
+                return False
+
+            if winners:
+                await db.executemany(
+                    'UPDATE users SET balance = balance + ?, giveaways_won = giveaways_won + 1 WHERE user_id = ?',
+                    [(amount, user_id) for user_id in winners]
+                )
+                await db.executemany(
+                    "INSERT INTO transactions (user_id, amount, type, description) VALUES (?, ?, 'win', ?)",
+                    [(user_id, amount, description) for user_id in winners]
+                )
+                await db.executemany(
+                    'UPDATE participants SET is_winner = 1 WHERE giveaway_id = ? AND user_id = ?',
+                    [(giveaway_id, user_id) for user_id in winners]
+                )
+
+            if commission > 0:
+                await db.execute(
+                    "INSERT INTO transactions (user_id, amount, type, description) "
+                    "SELECT creator_id, ?, 'commission', ? FROM giveaways_v2 WHERE id = ?",
+                    (commission, f"Комиссия с розыгрыша #{giveaway_id}", giveaway_id)
+                )
+                await self._bump_stats(db, commission=commission)
+
+            await db.commit()
+            return True
+
     async def get_giveaway_v2(self, giveaway_id: int):
         """Получение розыгрыша v2"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._reader() as db:
             async with db.execute('SELECT * FROM giveaways_v2 WHERE id = ?',
                                 (giveaway_id,)) as cursor:
                 return await cursor.fetchone()
 
-    async def get_active_giveaways(self):
-        """Получение всех активных розыгрышей"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM giveaways_v2 WHERE status = 'active'") as cursor:
+    async def get_active_giveaways(self, giveaway_ids=None):
+        """Получение активных розыгрышей (всех или только из giveaway_ids)"""
+        sql, params = self._active_filter("SELECT * FROM giveaways_v2 WHERE status = 'active'", 'id', giveaway_ids)
+        async with self._reader() as db:
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    async def get_active_giveaway_ids(self):
+        """ID всех активных розыгрышей"""
+        async with self._reader() as db:
+            async with db.execute("SELECT id FROM giveaways_v2 WHERE status = 'active'") as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    @staticmethod
+    def _active_filter(sql: str, column: str, giveaway_ids):
+        if giveaway_ids is None:
+            return sql, ()
+        giveaway_ids = list(giveaway_ids)
+        return f"{sql} AND {column} IN ({', '.join('?' * len(giveaway_ids))})", giveaway_ids
+
+    async def count_participants(self, giveaway_id: int) -> int:
+        """Число участников розыгрыша (по индексу (giveaway_id, user_id)), включая записанных другими экземплярами"""
+        async with self._reader() as db:
+            async with db.execute('SELECT COUNT(*) FROM participants WHERE giveaway_id = ?', (giveaway_id,)) as cursor:
+                return (await cursor.fetchone())[0]
+
+    async def get_active_participants(self, giveaway_ids=None):
+        """Участники активных розыгрышей одним запросом: кортежи (giveaway_id, user_id)"""
+        sql, params = self._active_filter(
+            "SELECT p.giveaway_id, p.user_id FROM participants p "
+            "JOIN giveaways_v2 g ON g.id = p.giveaway_id WHERE g.status = 'active'",
+            'g.id', giveaway_ids
+        )
+        async with self._reader() as db:
+            async with db.execute(sql, params) as cursor:
+                cursor.row_factory = None
                 return await cursor.fetchall()
 
+    # === АРЕНДА РОЗЫГРЫШЕЙ (несколько экземпляров бота на одной БД) ===
+    async def claim_giveaway_leases(self, owner: str, ttl: float):
+        '''Продление своих аренд и захват свободных или просроченных; возвращает ID своих розыгрышей.
+
+        Аренды завершенных и отмененных розыгрышей удаляются тут же.
+        '''
+        now = time.time()
+        async with self._writer() as db:
+            await db.execute('BEGIN IMMEDIATE')
+            await db.execute(
+                "DELETE FROM giveaway_leases WHERE giveaway_id NOT IN "
+                "(SELECT id FROM giveaways_v2 WHERE status = 'active')"
+            )
+            await db.execute('UPDATE giveaway_leases SET expires_at = ? WHERE owner = ?', (now + ttl, owner))
+            await db.execute(
+                "INSERT INTO giveaway_leases (giveaway_id, owner, expires_at) "
+                "SELECT id, ?, ? FROM giveaways_v2 WHERE status = 'active' "
+                "ON CONFLICT (giveaway_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE giveaway_leases.expires_at < ?",
+                (owner, now + ttl, now)
+            )
+            async with db.execute('SELECT giveaway_id FROM giveaway_leases WHERE owner = ?', (owner,)) as cursor:
+                owned = [row[0] for row in await cursor.fetchall()]
+            await db.commit()
+            return owned
+
+    async def release_giveaway_leases(self, owner: str):
+        '''Освобождение всех аренд экземпляра (при штатной остановке)'''
+        async with self._writer() as db:
+            await db.execute('DELETE FROM giveaway_leases WHERE owner = ?', (owner,))
+            await db.commit()
+
 
 # Глобальный экземпляр БД
 db = Database()
\ No newline at end of file
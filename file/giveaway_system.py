@@ -1,21 +1,146 @@
 # Новая система розыгрышей
 import asyncio
+import heapq
+import itertools
 import random
-from datetime import datetime, timedelta
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Optional
 from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
-from aiogram.utils.keyboard import InlineKeyboardBuilder
 import logging
+from subscriptions import SubscriptionCache
+from participants import ParticipantSet, reservoir_sample
+from rate_limit import PRIORITY_COSMETIC, PRIORITY_PAYOUT, TokenBucket, outbound_priority, request_priority
 
 logger = logging.getLogger(__name__)
 
+# Минимальный интервал между правками одного сообщения розыгрыша (сек)
+MESSAGE_EDIT_INTERVAL = 5.0
+
+# Периодическое обновление поста: интервал и случайный разброс, чтобы
+# тысячи розыгрышей не просыпались на одной и той же секунде
+REFRESH_INTERVAL = 60.0
+REFRESH_JITTER = 15.0
+
+# Запросы getChat за именами победителей: в секунду. Планировщик запросов
+# ограничивает только отправку сообщений, поэтому лимит здесь свой
+WINNER_LOOKUP_RATE = 25.0
+
+# Аренда розыгрышей при нескольких экземплярах бота: срок и период продления (сек).
+# Розыгрыши упавшего экземпляра подхватываются не позже чем через LEASE_TTL + LEASE_HEARTBEAT
+LEASE_TTL = 10.0
+LEASE_HEARTBEAT = 3.0
+
+class GiveawayScheduler:
+    """Единый планировщик таймеров розыгрышей.
+
+    Хранит min-кучу записей [deadline, seq, giveaway_id, action, active]
+    и одну фоновую задачу, которая спит до ближайшего срока. Отмена
+    помечает запись неактивной (ленивое удаление), куча перестраивается,
+    когда неактивных записей становится больше половины.
+    """
+    
+    def __init__(self, handler):
+        self._handler = handler  # async handler(giveaway_id, action)
+        self._heap: list = []
+        self._entries: Dict[tuple, list] = {}  # (giveaway_id, action) -> запись в куче
+        self._counter = itertools.count()
+        self._cancelled = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running: set = set()
+    
+    def schedule(self, deadline: float, giveaway_id: int, action: str):
+        """Запланировать действие на момент deadline (time.time()); заменяет прежнее такое же"""
+        self._discard(giveaway_id, action)
+        entry = [deadline, next(self._counter), giveaway_id, action, True]
+        self._entries[(giveaway_id, action)] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    def cancel(self, giveaway_id: int):
+        """Отменить все запланированные действия розыгрыша"""
+        for action in ('refresh', 'finish'):
+            self._discard(giveaway_id, action)
+        if self._cancelled > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap if entry[4]]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+    
+    def _discard(self, giveaway_id: int, action: str):
+        entry = self._entries.pop((giveaway_id, action), None)
+        if entry is not None:
+            entry[4] = False
+            self._cancelled += 1
+    
+    async def _run(self):
+        while True:
+            while self._heap and not self._heap[0][4]:
+                heapq.heappop(self._heap)
+                self._cancelled -= 1
+            
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            _, _, giveaway_id, action, _ = heapq.heappop(self._heap)
+            del self._entries[(giveaway_id, action)]
+            task = asyncio.create_task(self._handle(giveaway_id, action))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+    
+    async def _handle(self, giveaway_id: int, action: str):
+        try:
+            await self._handler(giveaway_id, action)
+        except Exception as e:
+            logger.error(f"Ошибка таймера розыгрыша #{giveaway_id} ({action}): {e}")
+    
+    async def stop(self):
+        """Остановка планировщика с ожиданием уже запущенных действий"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
 class GiveawaySystem:
-    def __init__(self, bot: Bot, db):
+    def __init__(self, bot: Bot, db, edit_interval: float = MESSAGE_EDIT_INTERVAL,
+                 subscriptions: Optional[SubscriptionCache] = None, instance_id: Optional[str] = None,
+                 lease_ttl: float = LEASE_TTL, lease_heartbeat: float = LEASE_HEARTBEAT):
+        """instance_id включает режим нескольких экземпляров: таймеры, правки поста
+        и выплаты ведет только экземпляр, арендовавший розыгрыш в giveaway_leases."""
         self.bot = bot
         self.db = db
+        self.subscriptions = subscriptions or SubscriptionCache(bot)
         self.active_giveaways: Dict[int, Dict] = {}  # giveaway_id -> giveaway_data
-        self.giveaway_tasks: Dict[int, asyncio.Task] = {}  # giveaway_id -> task
+        self.scheduler = GiveawayScheduler(self._on_timer)
+        self.edit_interval = edit_interval
+        self._dirty_messages: set = set()  # розыгрыши, ожидающие обновления сообщения
+        self._editor_task: Optional[asyncio.Task] = None
+        self._bot_username: Optional[str] = None
+        self._render_cache: Dict[int, Dict] = {}  # giveaway_id -> статичные части поста и хэш последней отправки
+        self.lookup_limiter = TokenBucket(WINNER_LOOKUP_RATE)
+        self.instance_id = instance_id
+        self.lease_ttl = lease_ttl
+        self.lease_heartbeat = lease_heartbeat
+        self._owned: set = set()  # арендованные этим экземпляром розыгрыши
+        self._lease_task: Optional[asyncio.Task] = None
+        self._lease_lock = asyncio.Lock()  # создание розыгрыша не пересекается с синхронизацией аренд
         
     async def create_giveaway(
         self,
@@ -28,110 +153,189 @@ class GiveawaySystem:
         duration_minutes: int,
         photo_path: Optional[str] = None,
         description: Optional[str] = None,
-        strategy: str = 'random'
+        strategy: str = 'random',
+        photo_file_id: Optional[str] = None
     ) -> int:
         """Создание нового розыгрыша"""
         
-        # Сохраняем в БД
-        giveaway_id = await self.db.create_giveaway_v2(
-            creator_id=creator_id,
-            target_type=target_type,
-            target_id=target_id,
-            prize_amount=prize_amount,
-            currency=currency,
-            winners_count=winners_count,
-            duration_minutes=duration_minutes,
-            strategy=strategy,
-            description=description,
-            photo_path=photo_path
-        )
-        
-        # Сохраняем в активные
-        end_time = datetime.now() + timedelta(minutes=duration_minutes)
-        self.active_giveaways[giveaway_id] = {
-            'id': giveaway_id,
-            'creator_id': creator_id,
-            'target_type': target_type,
-            'target_id': target_id,
-            'prize_amount': prize_amount,
-            'currency': currency,
-            'winners_count': winners_count,
-            'duration_minutes': duration_minutes,
-            'strategy': strategy,
-            'description': description,
-            'photo_path': photo_path,
-            'start_time': datetime.now(),
-            'end_time': end_time,
-            'participants': set(),
-            'message_id': None
-        }
+        async with self._lease_lock:
+            # Сохраняем в БД (при нескольких экземплярах — сразу со своей арендой)
+            giveaway_id = await self.db.create_giveaway_v2(
+                creator_id=creator_id,
+                target_type=target_type,
+                target_id=target_id,
+                prize_amount=prize_amount,
+                currency=currency,
+                winners_count=winners_count,
+                duration_minutes=duration_minutes,
+                strategy=strategy,
+                description=description,
+                photo_path=photo_path,
+                photo_file_id=photo_file_id,
+                lease_owner=self.instance_id,
+                lease_ttl=self.lease_ttl
+            )
+            if self.instance_id is not None:
+                self._owned.add(giveaway_id)
+            
+            # Сохраняем в активные
+            end_time = datetime.now() + timedelta(minutes=duration_minutes)
+            self.active_giveaways[giveaway_id] = {
+                'id': giveaway_id,
+                'creator_id': creator_id,
+                'target_type': target_type,
+                'target_id': target_id,
+                'prize_amount': prize_amount,
+                'currency': currency,
+                'winners_count': winners_count,
+                'duration_minutes': duration_minutes,
+                'strategy': strategy,
+                'description': description,
+                'photo_path': photo_path,
+                'photo_file_id': photo_file_id,
+                'start_time': datetime.now(),
+                'end_time': end_time,
+                'participants': ParticipantSet(),
+                'message_id': None
+            }
         
         # Отправляем сообщение о розыгрыше
         await self._send_giveaway_message(giveaway_id)
         
-        # Запускаем таймер
-        task = asyncio.create_task(self._giveaway_timer(giveaway_id))
-        self.giveaway_tasks[giveaway_id] = task
+        # Планируем обновления и завершение
+        self._schedule_giveaway(giveaway_id)
+        self._ensure_lease_heartbeat()
         
         logger.info(f"Создан розыгрыш #{giveaway_id} для {target_type} {target_id}")
         return giveaway_id
     
+    async def restore_active_giveaways(self) -> int:
+        """Восстановление активных розыгрышей из БД после перезапуска.
+        
+        Два запроса: строки giveaways_v2 и все их участники. Таймеры
+        планируются заново; просроченные розыгрыши завершаются сразу.
+        При нескольких экземплярах таймеры ставятся только на арендованные.
+        """
+        count, participants_count = await self._load_giveaways()
+        if self.instance_id is None:
+            for giveaway_id in self.active_giveaways:
+                self._schedule_giveaway(giveaway_id)
+        else:
+            await self._sync_leases()
+            self._ensure_lease_heartbeat()
+        
+        logger.info(f"Восстановлено активных розыгрышей: {count}, участников: {participants_count}")
+        return count
+    
+    async def _load_giveaways(self, giveaway_ids=None):
+        """Загрузка активных розыгрышей (всех или из giveaway_ids) с участниками в память"""
+        rows = await self.db.get_active_giveaways(giveaway_ids)
+        participants = await self.db.get_active_participants(giveaway_ids)
+        
+        for row in rows:
+            # created_at хранится SQLite в UTC, время в памяти — локальное
+            start_time = (
+                datetime.fromisoformat(row['created_at'])
+                .replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+            )
+            self.active_giveaways[row['id']] = {
+                'id': row['id'],
+                'creator_id': row['creator_id'],
+                'target_type': row['target_type'],
+                'target_id': row['target_id'],
+                'prize_amount': row['prize_amount'],
+                'currency': row['currency'],
+                'winners_count': row['winners_count'],
+                'duration_minutes': row['duration_minutes'],
+                'strategy': row['strategy'],
+                'description': row['description'],
+                'photo_path': row['photo_path'],
+                'photo_file_id': row['photo_file_id'],
+                'start_time': start_time,
+                'end_time': start_time + timedelta(minutes=row['duration_minutes']),
+                'participants': ParticipantSet(),
+                'message_id': row['message_id']
+            }
+        
+        # Собираем ID по розыгрышам и строим массивы одной сортировкой
+        participant_ids: Dict[int, List[int]] = {}
+        for giveaway_id, user_id in participants:
+            participant_ids.setdefault(giveaway_id, []).append(user_id)
+        for giveaway_id, user_ids in participant_ids.items():
+            giveaway = self.active_giveaways.get(giveaway_id)
+            if giveaway is not None:
+                giveaway['participants'] = ParticipantSet(user_ids)
+        
+        return len(rows), len(participants)
+    
+    def _ensure_lease_heartbeat(self):
+        if self.instance_id is not None and (self._lease_task is None or self._lease_task.done()):
+            self._lease_task = asyncio.create_task(self._lease_heartbeat())
+    
+    async def _lease_heartbeat(self):
+        """Фоновое продление аренд и подхват розыгрышей остановившихся экземпляров"""
+        while True:
+            await asyncio.sleep(self.lease_heartbeat)
+            try:
+                await self._sync_leases()
+            except Exception as e:
+                logger.error(f"Ошибка продления аренды розыгрышей: {e}")
+    
+    async def _sync_leases(self):
+        """Продление и захват аренд; синхронизация розыгрышей, созданных и завершенных другими экземплярами"""
+        async with self._lease_lock:
+            await self._sync_leases_locked()
+    
+    async def _sync_leases_locked(self):
+        # Админы и комиссии могли измениться через другой экземпляр
+        await self.db.sync_caches()
+        owned = set(await self.db.claim_giveaway_leases(self.instance_id, self.lease_ttl))
+        active = set(await self.db.get_active_giveaway_ids())
+        
+        # Завершены или отменены другим экземпляром
+        for giveaway_id in list(self.active_giveaways):
+            if giveaway_id not in active:
+                self._forget_giveaway(giveaway_id)
+        # Созданы другим экземпляром: загружаем, чтобы принимать заявки
+        missing = active - self.active_giveaways.keys()
+        if missing:
+            await self._load_giveaways(missing)
+        
+        for giveaway_id in self._owned - owned:
+            logger.warning(f"Аренда розыгрыша #{giveaway_id} перешла другому экземпляру")
+            self.scheduler.cancel(giveaway_id)
+        acquired = [giveaway_id for giveaway_id in owned - self._owned if giveaway_id in self.active_giveaways]
+        if acquired:
+            # Пост мог быть отправлен прежним владельцем уже после загрузки розыгрыша
+            for row in await self.db.get_active_giveaways(acquired):
+                giveaway = self.active_giveaways.get(row['id'])
+                if giveaway is not None:
+                    giveaway['message_id'] = row['message_id']
+                    giveaway['photo_file_id'] = row['photo_file_id']
+        for giveaway_id in acquired:
+            if giveaway_id in self.active_giveaways:
+                self._schedule_giveaway(giveaway_id)
+        self._owned = owned
+    
+    def _owns(self, giveaway_id: int) -> bool:
+        return self.instance_id is None or giveaway_id in self._owned
+    
     async def _send_giveaway_message(self, giveaway_id: int):
         """Отправка сообщения о розыгрыше в канал/чат"""
         giveaway = self.active_giveaways[giveaway_id]
-        
-        # Расчет суммы на победителя
-        prize_per_winner = giveaway['prize_amount'] / giveaway['winners_count']
-        
-        # Получаем комиссию для целевого объекта
-        commission_info = await self._get_commission(giveaway['target_type'], giveaway['target_id'])
-        commission_amount = self._calculate_commission(prize_per_winner, commission_info)
-        final_prize_per_winner = prize_per_winner - commission_amount
-        
-        # Формируем текст
-        end_time_str = giveaway['end_time'].strftime("%d.%m.%Y %H:%M")
-        time_left = self._format_time_left(giveaway['end_time'])
-        
-        text = f"🎉 <b>РОЗЫГРЫШ</b> 🎉\n\n"
-        
-        if giveaway['description']:
-            text += f"📝 {giveaway['description']}\n\n"
-        
-        text += f"💰 <b>Общий призовой фонд:</b> {giveaway['prize_amount']} {giveaway['currency']}\n"
-        text += f"🏆 <b>Количество победителей:</b> {giveaway['winners_count']}\n"
-        text += f"💵 <b>Каждый победитель получит:</b> {final_prize_per_winner:.2f} {giveaway['currency']}\n"
-        
-        if commission_amount > 0:
-            text += f"💼 <i>Комиссия: {commission_amount:.2f} {giveaway['currency']}</i>\n"
-        
-        text += f"\n⏰ <b>Окончание:</b> {end_time_str}\n"
-        text += f"⏳ <b>Осталось:</b> {time_left}\n\n"
-        text += f"👥 <b>Участников:</b> 0\n\n"
-        text += f"🎯 <b>Стратегия выбора:</b> {self._get_strategy_name(giveaway['strategy'])}\n\n"
-        text += "Нажмите кнопку ниже, чтобы участвовать!"
-        
-        # Создаем клавиатуру
-        keyboard = InlineKeyboardBuilder()
-        keyboard.row(InlineKeyboardButton(
-            text="🎁 Участвовать в розыгрыше",
-            url=f"https://t.me/{(await self.bot.me()).username}?start=join_{giveaway_id}"
-        ))
-        keyboard.row(InlineKeyboardButton(
-            text="📊 Участники: 0",
-            callback_data=f"giveaway_info_{giveaway_id}"
-        ))
+        text, keyboard = await self._render_giveaway(giveaway_id)
         
         # Отправляем сообщение
         try:
-            if giveaway['photo_path']:
-                # С фото
-                photo = FSInputFile(giveaway['photo_path'])
+            if self._has_photo(giveaway):
+                # С фото: по file_id без повторной загрузки, с диска — только для старых розыгрышей
+                photo = giveaway['photo_file_id'] or FSInputFile(giveaway['photo_path'])
                 message = await self.bot.send_photo(
                     chat_id=giveaway['target_id'],
                     photo=photo,
                     caption=text,
                     parse_mode="HTML",
-                    reply_markup=keyboard.as_markup()
+                    reply_markup=keyboard
                 )
             else:
                 # Без фото
@@ -139,12 +343,16 @@ class GiveawaySystem:
                     chat_id=giveaway['target_id'],
                     text=text,
                     parse_mode="HTML",
-                    reply_markup=keyboard.as_markup()
+                    reply_markup=keyboard
                 )
             
-            # Сохраняем ID сообщения
+            # Сохраняем ID сообщения, file_id отправленного фото и хэш текста
             giveaway['message_id'] = message.message_id
-            await self.db.update_giveaway_message_id(giveaway_id, message.message_id)
+            self._render_cache[giveaway_id]['sent_hash'] = hash(text)
+            photo_file_id = None
+            if self._has_photo(giveaway) and message.photo and message.photo[-1].file_id != giveaway['photo_file_id']:
+                photo_file_id = giveaway['photo_file_id'] = message.photo[-1].file_id
+            await self.db.update_giveaway_message_id(giveaway_id, message.message_id, photo_file_id)
             
             logger.info(f"Сообщение о розыгрыше #{giveaway_id} отправлено")
             
@@ -153,11 +361,10 @@ class GiveawaySystem:
     
     async def join_giveaway(self, giveaway_id: int, user_id: int) -> Dict:
         """Присоединение пользователя к розыгрышу"""
-        if giveaway_id not in self.active_giveaways:
+        giveaway = await self.find_active_giveaway(giveaway_id)
+        if giveaway is None:
             return {'success': False, 'reason': 'not_found'}
         
-        giveaway = self.active_giveaways[giveaway_id]
-        
         # Проверка, не закончился ли розыгрыш
         if datetime.now() >= giveaway['end_time']:
             return {'success': False, 'reason': 'ended'}
@@ -170,74 +377,59 @@ class GiveawaySystem:
         if not await self._check_subscription(user_id, giveaway['target_id']):
             return {'success': False, 'reason': 'not_subscribed'}
         
-        # Добавляем участника
+        # Добавляем участника сразу в память, чтобы повторные заявки отсекались
         giveaway['participants'].add(user_id)
-        await self.db.add_participant(giveaway_id, user_id)
-        await self.db.increment_participation(user_id)
+        # Запись в БД идет пакетами (см. Database.enqueue_participant);
+        # об успехе сообщаем только после фиксации пакета
+        added = await self.db.enqueue_participant(giveaway_id, user_id)
+        if added is None:
+            giveaway['participants'].discard(user_id)
+            return {'success': False, 'reason': 'error'}
+        if not added:
+            # Запись уже была в БД (например, участие через другой экземпляр бота)
+            return {'success': False, 'reason': 'already_joined'}
         
-        # Обновляем сообщение
-        await self._update_giveaway_message(giveaway_id)
+        # Сообщение обновит фоновый редактор (одна правка на окно edit_interval)
+        self._mark_message_dirty(giveaway_id)
         
         logger.info(f"Пользователь {user_id} присоединился к розыгрышу #{giveaway_id}")
         
+        if self.instance_id is None:
+            participants_count = len(giveaway['participants'])
+        else:
+            # В памяти только заявки этого экземпляра, как и на посте считаем по БД
+            participants_count = await self.db.count_participants(giveaway_id)
         return {
             'success': True,
-            'participants_count': len(giveaway['participants']),
+            'participants_count': participants_count,
             'prize_per_winner': giveaway['prize_amount'] / giveaway['winners_count']
         }
     
+    @staticmethod
+    def _has_photo(giveaway: Dict) -> bool:
+        return bool(giveaway['photo_file_id'] or giveaway['photo_path'])
+    
     async def _update_giveaway_message(self, giveaway_id: int):
-        """Обновление сообщения о розыгрыше"""
+        """Обновление сообщения о розыгрыше (пропускается, если видимый текст не изменился)"""
         giveaway = self.active_giveaways[giveaway_id]
         
         if not giveaway['message_id']:
             return
         
-        prize_per_winner = giveaway['prize_amount'] / giveaway['winners_count']
-        commission_info = await self._get_commission(giveaway['target_type'], giveaway['target_id'])
-        commission_amount = self._calculate_commission(prize_per_winner, commission_info)
-        final_prize_per_winner = prize_per_winner - commission_amount
-        
-        end_time_str = giveaway['end_time'].strftime("%d.%m.%Y %H:%M")
-        time_left = self._format_time_left(giveaway['end_time'])
-        participants_count = len(giveaway['participants'])
-        
-        text = f"🎉 <b>РОЗЫГРЫШ</b> 🎉\n\n"
-        
-        if giveaway['description']:
-            text += f"📝 {giveaway['description']}\n\n"
-        
-        text += f"💰 <b>Общий призовой фонд:</b> {giveaway['prize_amount']} {giveaway['currency']}\n"
-        text += f"🏆 <b>Количество победителей:</b> {giveaway['winners_count']}\n"
-        text += f"💵 <b>Каждый победитель получит:</b> {final_prize_per_winner:.2f} {giveaway['currency']}\n"
-        
-        if commission_amount > 0:
-            text += f"💼 <i>Комиссия: {commission_amount:.2f} {giveaway['currency']}</i>\n"
-        
-        text += f"\n⏰ <b>Окончание:</b> {end_time_str}\n"
-        text += f"⏳ <b>Осталось:</b> {time_left}\n\n"
-        text += f"👥 <b>Участников:</b> {participants_count}\n\n"
-        text += f"🎯 <b>Стратегия выбора:</b> {self._get_strategy_name(giveaway['strategy'])}\n\n"
-        text += "Нажмите кнопку ниже, чтобы участвовать!"
-        
-        keyboard = InlineKeyboardBuilder()
-        keyboard.row(InlineKeyboardButton(
-            text="🎁 Участвовать в розыгрыше",
-            url=f"https://t.me/{(await self.bot.me()).username}?start=join_{giveaway_id}"
-        ))
-        keyboard.row(InlineKeyboardButton(
-            text=f"📊 Участники: {participants_count}",
-            callback_data=f"giveaway_info_{giveaway_id}"
-        ))
+        text, keyboard = await self._render_giveaway(giveaway_id)
+        render = self._render_cache[giveaway_id]
+        text_hash = hash(text)
+        if render.get('sent_hash') == text_hash:
+            return
         
         try:
-            if giveaway['photo_path']:
+            if self._has_photo(giveaway):
                 await self.bot.edit_message_caption(
                     chat_id=giveaway['target_id'],
                     message_id=giveaway['message_id'],
                     caption=text,
                     parse_mode="HTML",
-                    reply_markup=keyboard.as_markup()
+                    reply_markup=keyboard
                 )
             else:
                 await self.bot.edit_message_text(
@@ -245,34 +437,148 @@ class GiveawaySystem:
                     message_id=giveaway['message_id'],
                     text=text,
                     parse_mode="HTML",
-                    reply_markup=keyboard.as_markup()
+                    reply_markup=keyboard
                 )
+            render['sent_hash'] = text_hash
+        except TelegramBadRequest as e:
+            if 'message is not modified' in str(e):
+                render['sent_hash'] = text_hash
+            else:
+                logger.error(f"Ошибка обновления сообщения розыгрыша #{giveaway_id}: {e}")
         except Exception as e:
             logger.error(f"Ошибка обновления сообщения розыгрыша #{giveaway_id}: {e}")
     
-    async def _giveaway_timer(self, giveaway_id: int):
-        """Таймер розыгрыша"""
+    async def _render_giveaway(self, giveaway_id: int):
+        """Текст и клавиатура поста: статичные части из кэша, динамические — время и участники"""
         giveaway = self.active_giveaways[giveaway_id]
+        template = await self._get_render_template(giveaway)
+        if self.instance_id is None:
+            participants_count = len(giveaway['participants'])
+        else:
+            # Заявки принимают все экземпляры, в памяти только свои: считаем по БД
+            participants_count = await self.db.count_participants(giveaway_id)
+        
+        text = (
+            f"{template['head']}"
+            f"⏳ <b>Осталось:</b> {self._format_time_left(giveaway['end_time'])}\n\n"
+            f"👥 <b>Участников:</b> {participants_count}\n\n"
+            f"{template['tail']}"
+        )
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [template['join_button']],
+            [InlineKeyboardButton(
+                text=f"📊 Участники: {participants_count}",
+                callback_data=f"giveaway_info_{giveaway_id}"
+            )]
+        ])
+        return text, keyboard
+    
+    async def _get_render_template(self, giveaway: Dict) -> Dict:
+        """Статичные части поста; пересобираются только при смене комиссии"""
+        giveaway_id = giveaway['id']
+        commission_info = await self._get_commission(giveaway['target_type'], giveaway['target_id'], giveaway['creator_id'])
+        render = self._render_cache.get(giveaway_id)
+        if render is not None and render['commission_info'] == commission_info:
+            return render
         
-        # Периодически обновляем сообщение
-        update_interval = 60  # каждую минуту
+        # Расчет суммы на победителя
+        prize_per_winner = giveaway['prize_amount'] / giveaway['winners_count']
+        commission_amount = self._calculate_commission(prize_per_winner, commission_info)
+        final_prize_per_winner = prize_per_winner - commission_amount
+        end_time_str = giveaway['end_time'].strftime("%d.%m.%Y %H:%M")
         
-        while datetime.now() < giveaway['end_time']:
-            time_left = (giveaway['end_time'] - datetime.now()).total_seconds()
-            
-            if time_left <= 0:
-                break
-            
-            # Ждем до следующего обновления или до конца
-            wait_time = min(update_interval, time_left)
-            await asyncio.sleep(wait_time)
-            
-            # Обновляем сообщение, если розыгрыш еще активен
-            if giveaway_id in self.active_giveaways:
-                await self._update_giveaway_message(giveaway_id)
+        head = f"🎉 <b>РОЗЫГРЫШ</b> 🎉\n\n"
+        
+        if giveaway['description']:
+            head += f"📝 {giveaway['description']}\n\n"
+        
+        head += f"💰 <b>Общий призовой фонд:</b> {giveaway['prize_amount']} {giveaway['currency']}\n"
+        head += f"🏆 <b>Количество победителей:</b> {giveaway['winners_count']}\n"
+        head += f"💵 <b>Каждый победитель получит:</b> {final_prize_per_winner:.2f} {giveaway['currency']}\n"
+        
+        if commission_amount > 0:
+            head += f"💼 <i>Комиссия: {commission_amount:.2f} {giveaway['currency']}</i>\n"
+        
+        head += f"\n⏰ <b>Окончание:</b> {end_time_str}\n"
+        
+        tail = (
+            f"🎯 <b>Стратегия выбора:</b> {self._get_strategy_name(giveaway['strategy'])}\n\n"
+            "Нажмите кнопку ниже, чтобы участвовать!"
+        )
         
-        # Завершаем розыгрыш
-        await self._finish_giveaway(giveaway_id)
+        render = {
+            'commission_info': commission_info,
+            'head': head,
+            'tail': tail,
+            'join_button': InlineKeyboardButton(
+                text="🎁 Участвовать в розыгрыше",
+                url=f"https://t.me/{await self._get_bot_username()}?start=join_{giveaway_id}"
+            ),
+            'sent_hash': render.get('sent_hash') if render else None,
+        }
+        self._render_cache[giveaway_id] = render
+        return render
+    
+    async def _get_bot_username(self) -> str:
+        """Username бота (запрашивается у API один раз)"""
+        if self._bot_username is None:
+            self._bot_username = (await self.bot.me()).username
+        return self._bot_username
+    
+    def _mark_message_dirty(self, giveaway_id: int):
+        """Пометка сообщения розыгрыша как устаревшего (пост правит только владелец аренды)"""
+        if not self._owns(giveaway_id):
+            return
+        self._dirty_messages.add(giveaway_id)
+        if self._editor_task is None or self._editor_task.done():
+            self._editor_task = asyncio.create_task(self._message_editor())
+    
+    async def _message_editor(self):
+        """Фоновый редактор: сливает все изменения за окно в одну правку на розыгрыш"""
+        # Правки постов уступают очередь остальным запросам к API
+        request_priority.set(PRIORITY_COSMETIC)
+        while self._dirty_messages:
+            await asyncio.sleep(self.edit_interval)
+            dirty, self._dirty_messages = self._dirty_messages, set()
+            for giveaway_id in dirty:
+                if giveaway_id in self.active_giveaways:
+                    await self._update_giveaway_message(giveaway_id)
+    
+    async def close(self):
+        """Остановка фоновых задач системы розыгрышей"""
+        await self.scheduler.stop()
+        if self._editor_task is not None:
+            self._editor_task.cancel()
+            self._editor_task = None
+        if self._lease_task is not None:
+            self._lease_task.cancel()
+            self._lease_task = None
+            # Отдаем розыгрыши другим экземплярам сразу, не дожидаясь истечения аренды
+            await self.db.release_giveaway_leases(self.instance_id)
+            self._owned = set()
+    
+    def _schedule_giveaway(self, giveaway_id: int):
+        """Постановка завершения и первого обновления розыгрыша в планировщик"""
+        giveaway = self.active_giveaways[giveaway_id]
+        self.scheduler.schedule(giveaway['end_time'].timestamp(), giveaway_id, 'finish')
+        self._schedule_refresh(giveaway_id)
+    
+    def _schedule_refresh(self, giveaway_id: int):
+        """Следующее обновление поста через REFRESH_INTERVAL (+ разброс), если розыгрыш еще идет"""
+        giveaway = self.active_giveaways[giveaway_id]
+        deadline = time.time() + REFRESH_INTERVAL + random.uniform(0, REFRESH_JITTER)
+        if deadline < giveaway['end_time'].timestamp():
+            self.scheduler.schedule(deadline, giveaway_id, 'refresh')
+    
+    async def _on_timer(self, giveaway_id: int, action: str):
+        """Обработчик срабатываний планировщика"""
+        if giveaway_id not in self.active_giveaways:
+            return
+        if action == 'refresh':
+            self._mark_message_dirty(giveaway_id)
+            self._schedule_refresh(giveaway_id)
+        elif action == 'finish':
+            await self._finish_giveaway(giveaway_id)
     
     async def _finish_giveaway(self, giveaway_id: int):
         """Завершение розыгрыша и выбор победителей"""
@@ -280,116 +586,116 @@ class GiveawaySystem:
             return
         
         giveaway = self.active_giveaways[giveaway_id]
-        participants = list(giveaway['participants'])
         
-        logger.info(f"Завершение розыгрыша #{giveaway_id}, участников: {len(participants)}")
+        logger.info(f"Завершение розыгрыша #{giveaway_id}, участников: {len(giveaway['participants'])}")
         
-        if not participants:
+        # Выбираем победителей по стратегии (по участникам в БД)
+        winners = await self._select_winners(giveaway_id)
+        
+        if not winners:
             # Нет участников
-            await self._send_no_winners_message(giveaway_id)
-            await self.db.finish_giveaway(giveaway_id)
-            del self.active_giveaways[giveaway_id]
+            if await self.db.settle_giveaway(giveaway_id, [], 0, 0):
+                await self._send_no_winners_message(giveaway)
+            self._forget_giveaway(giveaway_id)
             return
         
-        # Выбираем победителей по стратегии
-        winners = await self._select_winners(giveaway_id, participants)
-        
         # Вычисляем выплаты
         prize_per_winner = giveaway['prize_amount'] / len(winners)
-        commission_info = await self._get_commission(giveaway['target_type'], giveaway['target_id'])
+        commission_info = await self._get_commission(giveaway['target_type'], giveaway['target_id'], giveaway['creator_id'])
         commission_amount = self._calculate_commission(prize_per_winner, commission_info)
         final_prize = prize_per_winner - commission_amount
         
-        # Выплачиваем призы
-        for winner_id in winners:
-            await self.db.update_balance(winner_id, final_prize)
-            await self.db.add_transaction(
-                winner_id,
-                final_prize,
-                "win",
-                f"Выигрыш в розыгрыше #{giveaway_id}"
-            )
-            await self.db.increment_wins(winner_id)
-            await self.db.update_participant_winner(giveaway_id, winner_id)
-            
-            # Уведомляем победителя
-            try:
+        # Выплачиваем призы и записываем комиссию одной транзакцией
+        total_commission = commission_amount * len(winners)
+        if not await self.db.settle_giveaway(giveaway_id, winners, final_prize, total_commission,
+                                             winner_seed=giveaway.get('winner_seed')):
+            logger.warning(f"Розыгрыш #{giveaway_id} уже не активен в БД, выплата пропущена")
+            self._forget_giveaway(giveaway_id)
+            return
+        
+        # Выплаты проведены: дальше только уведомления, они не задерживают расчет
+        self._forget_giveaway(giveaway_id)
+        logger.info(f"Розыгрыш #{giveaway_id} завершен, победителей: {len(winners)}")
+        
+        await asyncio.gather(
+            self._send_winners_message(giveaway, winners, final_prize),
+            *(self._notify_winner(giveaway, winner_id, final_prize) for winner_id in winners)
+        )
+    
+    async def _notify_winner(self, giveaway: Dict, winner_id: int, prize: float):
+        """Личное уведомление победителю (вне очереди у планировщика запросов)"""
+        try:
+            with outbound_priority(PRIORITY_PAYOUT):
                 await self.bot.send_message(
                     winner_id,
                     f"🎉 <b>Поздравляем!</b>\n\n"
                     f"Вы выиграли в розыгрыше!\n"
-                    f"💰 Приз: {final_prize:.2f} {giveaway['currency']}\n\n"
+                    f"💰 Приз: {prize:.2f} {giveaway['currency']}\n\n"
                     f"Средства зачислены на ваш баланс.",
                     parse_mode="HTML"
                 )
-            except Exception as e:
-                logger.error(f"Ошибка уведомления победителя {winner_id}: {e}")
-        
-        # Записываем комиссию
-        total_commission = commission_amount * len(winners)
-        if total_commission > 0:
-            await self.db.add_transaction(
-                giveaway['creator_id'],
-                total_commission,
-                "commission",
-                f"Комиссия с розыгрыша #{giveaway_id}"
-            )
-        
-        # Отправляем сообщение о завершении
-        await self._send_winners_message(giveaway_id, winners, final_prize)
+        except Exception as e:
+            logger.error(f"Ошибка уведомления победителя {winner_id}: {e}")
+    
+    async def _get_winner_names(self, winners: List[int]) -> Dict[int, str]:
+        """Имена победителей: username из users, запрос к API только для отсутствующих"""
+        usernames = await self.db.get_usernames(winners)
         
-        # Завершаем розыгрыш
-        await self.db.finish_giveaway(giveaway_id)
-        del self.active_giveaways[giveaway_id]
+        async def fetch(winner_id: int):
+            await self.lookup_limiter.acquire()
+            try:
+                chat = await self.bot.get_chat(winner_id)
+                if chat.username:
+                    usernames[winner_id] = chat.username
+            except Exception:
+                pass
         
-        logger.info(f"Розыгрыш #{giveaway_id} завершен, победителей: {len(winners)}")
+        await asyncio.gather(*(fetch(w) for w in winners if w not in usernames))
+        return {
+            winner_id: f"@{usernames[winner_id]}" if winner_id in usernames else f"ID: {winner_id}"
+            for winner_id in winners
+        }
     
-    async def _select_winners(self, giveaway_id: int, participants: List[int]) -> List[int]:
+    async def _select_winners(self, giveaway_id: int) -> List[int]:
         """Выбор победителей по стратегии"""
         giveaway = self.active_giveaways[giveaway_id]
-        winners_count = min(giveaway['winners_count'], len(participants))
-        
-        if giveaway['strategy'] == 'random':
-            # Случайный выбор
-            return random.sample(participants, winners_count)
+        winners_count = giveaway['winners_count']
         
-        elif giveaway['strategy'] == 'first':
+        if giveaway['strategy'] == 'first':
             # Первые участники
-            participants_with_time = await self.db.get_participants_with_time(giveaway_id)
-            participants_with_time.sort(key=lambda x: x['joined_at'])
-            return [p['user_id'] for p in participants_with_time[:winners_count]]
+            await self.db.flush_joins()
+            return await self.db.get_first_participants(giveaway_id, winners_count)
         
         elif giveaway['strategy'] == 'active':
             # Самые активные (по количеству участий)
-            participants_data = []
-            for user_id in participants:
-                user = await self.db.get_user(user_id)
-                participants_data.append({
-                    'user_id': user_id,
-                    'activity': user['giveaways_participated']
-                })
-            
-            participants_data.sort(key=lambda x: x['activity'], reverse=True)
-            return [p['user_id'] for p in participants_data[:winners_count]]
+            await self.db.flush_joins()
+            return await self.db.get_most_active_participants(giveaway_id, winners_count)
         
         else:
-            # По умолчанию случайный
-            return random.sample(participants, winners_count)
+            # Случайный выбор (стратегия random и по умолчанию)
+            return await self._select_random_winners(giveaway_id, winners_count)
     
-    async def _send_winners_message(self, giveaway_id: int, winners: List[int], prize_per_winner: float):
-        """Отправка сообщения о победителях"""
+    async def _select_random_winners(self, giveaway_id: int, winners_count: int) -> List[int]:
+        """Случайный выбор одним проходом по участникам в БД.
+
+        Не требует списка участников в памяти и работает после перезапуска.
+        Seed логируется и сохраняется при выплате: обход идет по user_id,
+        поэтому выбор можно повторить по тем же данным.
+        """
+        await self.db.flush_joins()
+        seed = secrets.randbits(63)
         giveaway = self.active_giveaways.get(giveaway_id)
-        if not giveaway:
-            return
-        
-        winners_text = []
-        for winner_id in winners:
-            try:
-                user = await self.bot.get_chat(winner_id)
-                username = f"@{user.username}" if user.username else f"ID: {winner_id}"
-                winners_text.append(username)
-            except:
-                winners_text.append(f"ID: {winner_id}")
+        if giveaway is not None:
+            giveaway['winner_seed'] = seed
+        logger.info(f"Розыгрыш #{giveaway_id}: случайный выбор победителей, seed={seed}")
+        return await reservoir_sample(
+            self.db.iter_participant_chunks(giveaway_id), winners_count, random.Random(seed)
+        )
+    
+    async def _send_winners_message(self, giveaway: Dict, winners: List[int], prize_per_winner: float):
+        """Отправка сообщения о победителях"""
+        names = await self._get_winner_names(winners)
+        winners_text = [names[winner_id] for winner_id in winners]
         
         text = (
             f"🎊 <b>РОЗЫГРЫШ ЗАВЕРШЕН</b> 🎊\n\n"
@@ -408,12 +714,8 @@ class GiveawaySystem:
         except Exception as e:
             logger.error(f"Ошибка отправки сообщения о победителях: {e}")
     
-    async def _send_no_winners_message(self, giveaway_id: int):
+    async def _send_no_winners_message(self, giveaway: Dict):
         """Сообщение при отсутствии участников"""
-        giveaway = self.active_giveaways.get(giveaway_id)
-        if not giveaway:
-            return
-        
         text = (
             f"😔 <b>РОЗЫГРЫШ ЗАВЕРШЕН</b>\n\n"
             f"К сожалению, не было ни одного участника.\n"
@@ -430,33 +732,16 @@ class GiveawaySystem:
             logger.error(f"Ошибка отправки сообщения об отсутствии победителей: {e}")
     
     async def _check_subscription(self, user_id: int, chat_id: str) -> bool:
-        """Проверка подписки пользователя"""
+        """Проверка подписки пользователя (через TTL-кэш)"""
         try:
-            member = await self.bot.get_chat_member(chat_id, user_id)
-            return member.status in ['member', 'administrator', 'creator']
+            return await self.subscriptions.is_member(chat_id, user_id)
         except Exception as e:
             logger.error(f"Ошибка проверки подписки: {e}")
             return False
     
-    async def _get_commission(self, target_type: str, target_id: str) -> Dict:
-        """Получение комиссии для цели"""
-        if target_type == 'channel':
-            channel = await self.db.get_channel(target_id)
-            if channel:
-                return {
-                    'value': channel['commission'],
-                    'type': channel['commission_type']
-                }
-        elif target_type == 'chat':
-            chat_comm = await self.db.get_chat_commission(target_id)
-            if chat_comm:
-                return {
-                    'value': chat_comm['value'],
-                    'type': chat_comm['commission_type']
-                }
-        
-        # По умолчанию 5%
-        return {'value': 5.0, 'type': 'percent'}
+    async def _get_commission(self, target_type: str, target_id: str, creator_id: Optional[int] = None) -> Dict:
+        """Получение комиссии для цели (из кэша CommissionResolver)"""
+        return await self.db.commissions.resolve(target_type, target_id, creator_id)
     
     def _calculate_commission(self, amount: float, commission_info: Dict) -> float:
         """Расчет комиссии"""
@@ -503,9 +788,7 @@ class GiveawaySystem:
         giveaway = self.active_giveaways[giveaway_id]
         
         # Останавливаем таймер
-        if giveaway_id in self.giveaway_tasks:
-            self.giveaway_tasks[giveaway_id].cancel()
-            del self.giveaway_tasks[giveaway_id]
+        self.scheduler.cancel(giveaway_id)
         
         # Уведомляем в канале/чате
         text = (
@@ -527,15 +810,33 @@ class GiveawaySystem:
         await self.db.cancel_giveaway(giveaway_id, reason)
         
         # Удаляем из активных
-        del self.active_giveaways[giveaway_id]
+        self._forget_giveaway(giveaway_id)
         
         logger.info(f"Розыгрыш #{giveaway_id} отменен: {reason}")
         return True
     
+    def _forget_giveaway(self, giveaway_id: int):
+        """Удаление завершенного/отмененного розыгрыша из памяти"""
+        self.active_giveaways.pop(giveaway_id, None)
+        self._render_cache.pop(giveaway_id, None)
+        self._owned.discard(giveaway_id)
+        self.scheduler.cancel(giveaway_id)
+    
     def get_active_giveaway(self, giveaway_id: int) -> Optional[Dict]:
         """Получить информацию об активном розыгрыше"""
         return self.active_giveaways.get(giveaway_id)
     
+    async def find_active_giveaway(self, giveaway_id: int) -> Optional[Dict]:
+        """Активный розыгрыш; при нескольких экземплярах созданный другим экземпляром
+        догружается из БД, не дожидаясь синхронизации аренд"""
+        giveaway = self.active_giveaways.get(giveaway_id)
+        if giveaway is None and self.instance_id is not None:
+            async with self._lease_lock:
+                if giveaway_id not in self.active_giveaways:
+                    await self._load_giveaways([giveaway_id])
+            giveaway = self.active_giveaways.get(giveaway_id)
+        return giveaway
+    
     def get_all_active_giveaways(self) -> List[Dict]:
         """Получить все активные розыгрыши"""
         return list(self.active_giveaways.values())
\ No newline at end of file
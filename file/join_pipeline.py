@@ -0,0 +1,109 @@
+# join_pipeline.py (очередь приема заявок на участие в розыгрышах)
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOIN_QUEUE_SIZE = 10_000
+JOIN_WORKERS = 64  # обработчики ждут фиксации пакета участников, поэтому их больше, чем ядер
+
+JOIN_FAILURE_REASONS = {
+    'not_found': "Розыгрыш не найден или уже завершен",
+    'ended': "Розыгрыш уже завершен",
+    'already_joined': "Вы уже участвуете в этом розыгрыше!",
+    'not_subscribed': "Вы должны быть подписаны на канал/чат для участия",
+    'pending': "Ваша заявка уже обрабатывается, подождите немного",
+    'busy': "Сейчас слишком много заявок, попробуйте через минуту",
+    'error': "Не удалось сохранить участие, попробуйте еще раз",
+}
+
+
+def format_join_result(result: dict) -> str:
+    '''Текст ответа пользователю по результату GiveawaySystem.join_giveaway'''
+    if result['success']:
+        return (
+            f"🎉 <b>Вы участвуете в розыгрыше!</b>\n\n"
+            f"💰 Приз на победителя: ~{result['prize_per_winner']:.2f}\n"
+            f"👥 Всего участников: {result['participants_count']}\n\n"
+            f"Следите за результатами в канале/чате!\n"
+            f"Удачи! 🍀"
+        )
+    return f"❌ {JOIN_FAILURE_REASONS.get(result['reason'], 'Неизвестная ошибка')}"
+
+
+class JoinPipeline:
+    '''Прием заявок /start join_<id> через ограниченную очередь и пул обработчиков.
+
+    submit() делает только быстрые проверки и ставит заявку в очередь;
+    проверку подписки, сохранение пользователя и участие выполняют
+    обработчики, которые присылают итог отдельным сообщением после
+    фиксации участия в БД. При заполненной очереди заявка отклоняется
+    с причиной 'busy'.
+    '''
+
+    def __init__(self, bot, db, giveaway_system, workers: int = JOIN_WORKERS,
+                 maxsize: int = JOIN_QUEUE_SIZE):
+        self.bot = bot
+        self.db = db
+        self.giveaway_system = giveaway_system
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._pending: set = set()  # (giveaway_id, user_id) в очереди или в обработке
+        self._tasks: List[asyncio.Task] = []
+
+    async def submit(self, giveaway_id: int, user_id: int, username: Optional[str] = None) -> Optional[str]:
+        '''Постановка заявки; None — принята, иначе причина отказа из JOIN_FAILURE_REASONS'''
+        giveaway = await self.giveaway_system.find_active_giveaway(giveaway_id)
+        if giveaway is None:
+            return 'not_found'
+        if datetime.now() >= giveaway['end_time']:
+            return 'ended'
+        if user_id in giveaway['participants']:
+            return 'already_joined'
+
+        key = (giveaway_id, user_id)
+        if key in self._pending:
+            return 'pending'
+        try:
+            self._queue.put_nowait((giveaway_id, user_id, username))
+        except asyncio.QueueFull:
+            logger.debug(f"Очередь заявок переполнена, отказ user_id={user_id} в розыгрыше #{giveaway_id}")
+            return 'busy'
+        self._pending.add(key)
+        self._ensure_workers()
+        return None
+
+    def _ensure_workers(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self):
+        while True:
+            giveaway_id, user_id, username = await self._queue.get()
+            try:
+                await self.db.add_user(user_id, username)
+                result = await self.giveaway_system.join_giveaway(giveaway_id, user_id)
+                await self.bot.send_message(user_id, format_join_result(result), parse_mode="HTML")
+            except Exception as e:
+                logger.error(f"Ошибка обработки заявки user_id={user_id} в розыгрыш #{giveaway_id}: {e}")
+            finally:
+                self._pending.discard((giveaway_id, user_id))
+                self._queue.task_done()
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    async def close(self, timeout: float = 10.0):
+        '''Дообработка очереди (не дольше timeout) и остановка обработчиков'''
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Не обработано заявок при остановке: {self._queue.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
@@ -4,20 +4,33 @@ import asyncio
 import logging
 import os
 import shutil
+import socket
 import random
 import re
 from datetime import datetime
 
+from aiohttp import web
 from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types.error_event import ErrorEvent
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
 import aiosqlite
 from giveaway_system import GiveawaySystem
-from config import BOT_TOKEN, ADMIN_ID
+from subscriptions import SubscriptionCache
+from join_pipeline import JoinPipeline, format_join_result
+from rate_limit import OutboundScheduler
+from broadcast import AdBroadcaster
+from config import (
+    BOT_TOKEN, ADMIN_ID, MESSAGE_EDIT_INTERVAL, JOIN_WORKERS, JOIN_QUEUE_SIZE, ARCHIVE_GIVEAWAY_PHOTOS,
+    MULTI_INSTANCE, BOT_MODE, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET,
+    TELEGRAM_API_URL, TELEGRAM_GLOBAL_RATE
+)
 from database import db
 from keyboards import (
     get_admin_menu, get_user_menu, get_commission_menu,
@@ -39,12 +52,20 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=session)
+# Все запросы к Bot API проходят через общие лимиты Telegram и повтор на 429
+bot.session.middleware(OutboundScheduler(global_rate=TELEGRAM_GLOBAL_RATE))
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
 # Инициализация системы розыгрышей
 giveaway_system = None
+join_pipeline = None
+ad_broadcaster = None
+
+# Общий кэш проверок подписки (для main и системы розыгрышей)
+subscription_cache = SubscriptionCache(bot)
 
 # Временное хранилище настроек розыгрыша
 giveaway_settings = {
@@ -71,15 +92,11 @@ ad_active = False
 ad_interval = 60
 
 async def is_admin(user_id: int) -> bool:
-    logger.info(f"Проверка админа для user_id={user_id}")
-    admins = await db.get_all_admins()
-    return user_id in [admin['user_id'] for admin in admins]
+    return await db.is_admin(user_id)
 
 async def check_subscription(user_id: int, chat_id: str) -> bool:
     try:
-        member = await bot.get_chat_member(chat_id, user_id)
-        logger.info(f"Проверка подписки: user_id={user_id}, chat_id={chat_id}, status={member.status}")
-        return member.status in ['member', 'administrator', 'creator']
+        return await subscription_cache.is_member(chat_id, user_id)
     except Exception as e:
         logger.error(f"Ошибка проверки подписки для user_id={user_id}, chat_id={chat_id}: {e}")
         return False
@@ -97,15 +114,22 @@ async def cancel_action(message: Message, state: FSMContext):
 
 # === СТАРТ БОТА ===
 async def on_startup():
-    global giveaway_system
+    global giveaway_system, join_pipeline, ad_broadcaster
     logger.info("Инициализация базы данных...")
-    await db.init_db()
-    await db.init_db_v2_tables()
-    await db.update_channels_table()  # Миграция таблицы channels
+    schema_version = await db.migrate()
+    logger.info(f"Версия схемы БД: {schema_version}")
     await db.add_admin(ADMIN_ID)
     logger.info("База данных готова!")
-    giveaway_system = GiveawaySystem(bot, db)
+    # При нескольких процессах на одной БД розыгрыши делятся через аренду
+    instance_id = f"{socket.gethostname()}:{os.getpid()}" if MULTI_INSTANCE else None
+    giveaway_system = GiveawaySystem(
+        bot, db, edit_interval=MESSAGE_EDIT_INTERVAL, subscriptions=subscription_cache, instance_id=instance_id
+    )
+    await giveaway_system.restore_active_giveaways()
+    join_pipeline = JoinPipeline(bot, db, giveaway_system, workers=JOIN_WORKERS, maxsize=JOIN_QUEUE_SIZE)
     logger.info("Система розыгрышей инициализирована!")
+    ad_broadcaster = AdBroadcaster(bot, db, instance_id=instance_id)
+    await ad_broadcaster.resume()
     os.makedirs("backups", exist_ok=True)
     os.makedirs("giveaway_photos", exist_ok=True)
     logger.info("Бот запущен и готов к работе!")
@@ -117,36 +141,24 @@ async def cmd_start(message: Message):
     user_id = message.from_user.id
     username = message.from_user.username
 
-    await db.add_user(user_id, username)
-
     args = message.text.split()
     if len(args) > 1 and args[1].startswith("join_"):
         giveaway_id = int(args[1].replace("join_", ""))
         logger.info(f"Попытка участия в розыгрыше giveaway_id={giveaway_id} от user_id={user_id}")
-        result = await giveaway_system.join_giveaway(giveaway_id, user_id)
-
-        if result['success']:
+        # Проверка подписки и запись идут в очереди заявок, здесь только быстрый ответ
+        reason = await join_pipeline.submit(giveaway_id, user_id, username)
+        if reason is None:
             await message.answer(
-                f"🎉 <b>Вы участвуете в розыгрыше!</b>\n\n"
-                f"💰 Приз на победителя: ~{result['prize_per_winner']:.2f}\n"
-                f"👥 Всего участников: {result['participants_count']}\n\n"
-                f"Следите за результатами в канале/чате!\n"
-                f"Удачи! 🍀",
+                "⏳ <b>Заявка на участие принята!</b>\n\n"
+                "Проверяем условия, результат придет следующим сообщением.",
                 parse_mode="HTML"
             )
         else:
-            reasons = {
-                'not_found': "Розыгрыш не найден или уже завершен",
-                'ended': "Розыгрыш уже завершен",
-                'already_joined': "Вы уже участвуете в этом розыгрыше!",
-                'not_subscribed': "Вы должны быть подписаны на канал/чат для участия"
-            }
-            await message.answer(
-                f"❌ {reasons.get(result['reason'], 'Неизвестная ошибка')}",
-                parse_mode="HTML"
-            )
+            await message.answer(format_join_result({'success': False, 'reason': reason}), parse_mode="HTML")
         return
 
+    await db.add_user(user_id, username)
+
     is_active = active_giveaway is not None
     is_admin_user = await is_admin(user_id)
     await message.answer(
@@ -275,7 +287,11 @@ async def add_channel_process(message: Message, state: FSMContext):
         return
 
     data = await state.get_data()
-    is_admin = data.get('is_admin', False)
+    # Не затеняем функцию is_admin: флаг показывает, что добавление начато из админ-панели
+    from_admin_panel = data.get('is_admin', False)
+    is_admin_user = from_admin_panel or await is_admin(message.from_user.id)
+    is_active = active_giveaway is not None
+    reply_markup = get_admin_menu() if from_admin_panel else get_user_menu(active_giveaway=is_active, is_admin=is_admin_user)
 
     # Обработка ввода: @username, числовой ID или t.me ссылка
     channel_id = text
@@ -307,7 +323,7 @@ async def add_channel_process(message: Message, state: FSMContext):
             return
 
         # Проверка прав пользователя (только для не-админов)
-        if not is_admin:
+        if not from_admin_panel:
             user_member = await bot.get_chat_member(channel_id, message.from_user.id)
             if user_member.status not in ['administrator', 'creator']:
                 logger.error(f"Пользователь user_id={message.from_user.id} не является админом в {channel_id}")
@@ -317,16 +333,16 @@ async def add_channel_process(message: Message, state: FSMContext):
                 )
                 return
 
-        await db.add_channel(channel_id, channel_name, chat_type=chat_type, added_by=message.from_user.id if not is_admin else None)
+        await db.add_channel(channel_id, channel_name, chat_type=chat_type, added_by=message.from_user.id if not from_admin_panel else None)
+        # Своя комиссия у нового канала не задана: показываем действующую (глобальную или комиссию чата)
+        commission = await db.commissions.resolve(chat_type, channel_id)
+        commission_text = f"{commission['value']}%" if commission['type'] == 'percent' else f"{commission['value']} (фиксированная)"
 
-        is_active = active_giveaway is not None
-        is_admin_user = await is_admin(message.from_user.id)
-        reply_markup = get_admin_menu() if is_admin else get_user_menu(active_giveaway=is_active, is_admin=is_admin_user)
         await message.answer(
             f"{'Канал' if chat_type == 'channel' else 'Чат'} добавлен!\n\n"
             f"Название: {channel_name}\n"
             f"ID: <code>{channel_id}</code>\n"
-            f"Комиссия: 5%",
+            f"Комиссия: {commission_text}",
             reply_markup=reply_markup,
             parse_mode="HTML"
         )
@@ -338,7 +354,7 @@ async def add_channel_process(message: Message, state: FSMContext):
             f"Убедитесь, что:\n"
             f"• Бот добавлен в канал/чат\n"
             f"• ID или ссылка указаны правильно",
-            reply_markup=get_admin_menu() if is_admin else get_user_menu(active_giveaway=active_giveaway is not None, is_admin=await is_admin(message.from_user.id)),
+            reply_markup=reply_markup,
             parse_mode="HTML"
         )
 
@@ -364,11 +380,13 @@ async def list_channels(callback: CallbackQuery):
     else:
         text = "Список каналов:\n\n"
         for channel in channels:
+            # NULL — своя комиссия не задана, действует глобальная
+            commission = "глобальная" if channel['commission'] is None else f"{channel['commission']} {channel['commission_type']}"
             text += (
                 f"• {channel['channel_name']}\n"
                 f"  ID: <code>{channel['channel_id']}</code>\n"
                 f"  Тип: {channel['chat_type']}\n"
-                f"  Комиссия: {channel['commission']} {channel['commission_type']}\n"
+                f"  Комиссия: {commission}\n"
                 f"  {'Активен' if channel['active'] else 'Неактивен'}\n"
                 f"  Добавил: {'Админ' if channel['added_by'] is None else f'ID {channel['added_by']}'}\n\n"
             )
@@ -431,16 +449,20 @@ async def delete_channel_process(message: Message, state: FSMContext):
 async def process_giveaway_photo(message: Message, state: FSMContext):
     logger.info(f"Обработка фото розыгрыша от user_id={message.from_user.id}")
     photo_path = None
+    photo_file_id = None
     
     if message.text not in ["/skip", "/cancel", "отмена"]:
         if message.photo:
+            # Публикуем по file_id: фото уже лежит на серверах Telegram
             photo = message.photo[-1]
-            file = await bot.get_file(photo.file_id)
+            photo_file_id = photo.file_id
             
-            os.makedirs("giveaway_photos", exist_ok=True)
-            photo_path = f"giveaway_photos/{photo.file_id}.jpg"
-            
-            await bot.download_file(file.file_path, photo_path)
+            if ARCHIVE_GIVEAWAY_PHOTOS:
+                # Необязательная копия на диске
+                file = await bot.get_file(photo.file_id)
+                os.makedirs("giveaway_photos", exist_ok=True)
+                photo_path = f"giveaway_photos/{photo.file_id}.jpg"
+                await bot.download_file(file.file_path, photo_path)
         else:
             await message.answer("Это не фото! Отправьте фото или /skip")
             return
@@ -448,7 +470,7 @@ async def process_giveaway_photo(message: Message, state: FSMContext):
         await cancel_action(message, state)
         return
     
-    await state.update_data(photo_path=photo_path)
+    await state.update_data(photo_path=photo_path, photo_file_id=photo_file_id)
     
     data = await state.get_data()
     
@@ -466,7 +488,7 @@ async def process_giveaway_photo(message: Message, state: FSMContext):
     
     if data.get('description'):
         text += f"📝 Описание: {data['description'][:100]}...\n"
-    if data.get('photo_path'):
+    if data.get('photo_file_id') or data.get('photo_path'):
         text += "🖼 С изображением\n"
     
     text += "\n<b>Все верно?</b>"
@@ -488,9 +510,57 @@ async def error_handler(update: ErrorEvent):
         await update.update.callback_query.answer("Произошла ошибка", show_alert=True)
 
 # === ЗАПУСК БОТА ===
+async def on_shutdown():
+    logger.info("Остановка бота...")
+    if join_pipeline is not None:
+        await join_pipeline.close()
+    if ad_broadcaster is not None:
+        await ad_broadcaster.close()
+    if giveaway_system is not None:
+        await giveaway_system.close()
+    await db.close()
+    logger.info("Соединения с базой данных закрыты")
+
+async def run_webhook():
+    """Прием обновлений вебхуком: aiohttp-сервер, каждое обновление обрабатывается отдельной задачей"""
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET не задан: запросы к вебхуку не проверяются")
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET or None,
+        handle_in_background=True
+    ).register(app, path=WEBHOOK_PATH)
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+        logger.info(f"Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 async def main():
     await on_startup()
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            # Вебхук, оставшийся от режима webhook, блокирует getUpdates
+            await bot.delete_webhook()
+            await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        await on_shutdown()
+        # Сессию закрываем последней: on_shutdown еще отправляет запросы к API
+        await bot.session.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,351 @@
+# migrations.py (версионные миграции схемы БД через PRAGMA user_version)
+#
+# Каждая миграция — (версия, описание, async-функция от соединения).
+# Database.migrate() выполняет все миграции с версией выше текущей
+# одной транзакцией и записывает новую версию в PRAGMA user_version.
+# Новые изменения схемы добавляются только в конец списка.
+
+
+async def _create_base_schema(db):
+    '''Базовая схема: все таблицы бота'''
+    # Таблица пользователей
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            balance REAL DEFAULT 0,
+            giveaways_won INTEGER DEFAULT 0,
+            giveaways_participated INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица админов
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id INTEGER PRIMARY KEY,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица каналов (с полями chat_type и added_by)
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS channels (
+            channel_id TEXT PRIMARY KEY,
+            channel_name TEXT,
+            commission REAL DEFAULT 5.0,
+            commission_type TEXT DEFAULT 'percent',
+            active INTEGER DEFAULT 1,
+            chat_type TEXT DEFAULT 'channel',
+            added_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица комиссий для чатов
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS chat_commissions (
+            chat_id TEXT PRIMARY KEY,
+            value REAL DEFAULT 5.0,
+            commission_type TEXT DEFAULT 'percent'
+        )
+    ''')
+
+    # Таблица комиссий для пользователей
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS user_commissions (
+            user_id INTEGER PRIMARY KEY,
+            value REAL DEFAULT 5.0,
+            commission_type TEXT DEFAULT 'percent'
+        )
+    ''')
+
+    # Таблица избранных
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS favorites (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT,
+            entity_id TEXT,
+            name TEXT
+        )
+    ''')
+
+    # Таблица розыгрышей
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS giveaways (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            creator_id INTEGER,
+            prize_amount REAL,
+            currency TEXT,
+            winners_count INTEGER,
+            strategy TEXT,
+            delay_minutes INTEGER,
+            status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+
+    # Таблица участников розыгрышей
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS participants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            giveaway_id INTEGER,
+            user_id INTEGER,
+            is_winner INTEGER DEFAULT 0,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (giveaway_id) REFERENCES giveaways(id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+
+    # Таблица рекламы
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS ads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT,
+            views INTEGER DEFAULT 0,
+            active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица отправок рекламы
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS ad_deliveries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ad_id INTEGER,
+            user_id INTEGER,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (ad_id) REFERENCES ads(id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+
+    # Таблица транзакций
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            type TEXT,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+
+    # Таблица глобальной комиссии
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS global_commission (
+            id INTEGER PRIMARY KEY DEFAULT 1,
+            value REAL DEFAULT 5.0,
+            commission_type TEXT DEFAULT 'percent'
+        )
+    ''')
+
+    # Убедимся, что глобальная комиссия существует
+    await db.execute('INSERT OR IGNORE INTO global_commission (id) VALUES (1)')
+
+    # Таблица розыгрышей v2
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS giveaways_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            creator_id INTEGER,
+            target_type TEXT,
+            target_id TEXT,
+            prize_amount REAL,
+            currency TEXT,
+            winners_count INTEGER,
+            duration_minutes INTEGER,
+            strategy TEXT,
+            description TEXT,
+            photo_path TEXT,
+            message_id INTEGER,
+            status TEXT DEFAULT 'active',
+            cancel_reason TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (creator_id) REFERENCES users(user_id)
+        )
+    ''')
+
+
+async def _add_missing_columns(db, table: str, columns):
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        existing = {col[1] for col in await cursor.fetchall()}
+    for name, definition in columns:
+        if name not in existing:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+async def _upgrade_legacy_columns(db):
+    '''Колонки, которых нет в базах, созданных до появления миграций'''
+    # Единственная проверка через PRAGMA table_info: после этой версии
+    # колонки добавляются обычными ALTER TABLE без проверок
+    await _add_missing_columns(db, 'channels', (
+        ('commission_type', "TEXT DEFAULT 'percent'"),
+        ('chat_type', "TEXT DEFAULT 'channel'"),
+        ('added_by', 'INTEGER'),
+    ))
+    await _add_missing_columns(db, 'giveaways', (
+        ('creator_id', 'INTEGER'),
+    ))
+
+
+async def _create_indexes(db):
+    '''Удаление дублей участников, уникальный ключ и индексы горячих таблиц'''
+    # Флаг победителя переносим на остающуюся (самую раннюю) запись
+    await db.execute('''
+        UPDATE participants SET is_winner = 1 WHERE id IN (
+            SELECT MIN(id) FROM participants
+            GROUP BY giveaway_id, user_id
+            HAVING COUNT(*) > 1 AND MAX(is_winner) = 1
+        )
+    ''')
+    await db.execute('''
+        DELETE FROM participants WHERE id NOT IN (
+            SELECT MIN(id) FROM participants GROUP BY giveaway_id, user_id
+        )
+    ''')
+    await db.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_participants_giveaway_user '
+        'ON participants (giveaway_id, user_id)'
+    )
+    await db.execute(
+        'CREATE INDEX IF NOT EXISTS idx_participants_giveaway_joined '
+        'ON participants (giveaway_id, joined_at)'
+    )
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_giveaways_v2_status ON giveaways_v2 (status)')
+    await db.execute(
+        'CREATE INDEX IF NOT EXISTS idx_transactions_user_type_created '
+        'ON transactions (user_id, type, created_at)'
+    )
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_ad_deliveries_ad ON ad_deliveries (ad_id)')
+
+
+async def _create_stats_rollup(db):
+    '''Дневные агрегаты для статистики и их заполнение по существующим данным'''
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day TEXT PRIMARY KEY,
+            users INTEGER DEFAULT 0,
+            giveaways INTEGER DEFAULT 0,
+            processed REAL DEFAULT 0,
+            commission REAL DEFAULT 0
+        )
+    ''')
+    await db.execute('''
+        INSERT INTO stats_daily (day, users, giveaways, processed, commission)
+        SELECT day, SUM(users), SUM(giveaways), SUM(processed), SUM(commission) FROM (
+            SELECT date(created_at) AS day, 1 AS users, 0 AS giveaways, 0 AS processed, 0 AS commission
+            FROM users
+            UNION ALL
+            SELECT date(created_at), 0, 1, COALESCE(prize_amount, 0), 0 FROM giveaways
+            UNION ALL
+            SELECT date(created_at), 0, 1, COALESCE(prize_amount, 0), 0 FROM giveaways_v2
+            UNION ALL
+            SELECT date(created_at), 0, 0, 0, amount FROM transactions WHERE type = 'commission'
+        ) WHERE day IS NOT NULL GROUP BY day
+    ''')
+
+
+async def _add_winner_seed(db):
+    '''Seed генератора случайного выбора победителей для проверки итогов'''
+    await db.execute('ALTER TABLE giveaways_v2 ADD COLUMN winner_seed INTEGER')
+
+
+async def _add_photo_file_id(db):
+    '''file_id фото розыгрыша в Telegram: отправка без загрузки с диска'''
+    await db.execute('ALTER TABLE giveaways_v2 ADD COLUMN photo_file_id TEXT')
+
+
+async def _create_ad_broadcasts(db):
+    '''Контрольные точки рассылок рекламы для продолжения после перезапуска'''
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS ad_broadcasts (
+            ad_id INTEGER PRIMARY KEY,
+            last_user_id INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'running',
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (ad_id) REFERENCES ads(id)
+        )
+    ''')
+
+
+async def _create_giveaway_leases(db):
+    '''Аренда розыгрышей экземплярами бота: таймеры и выплаты ведет только владелец'''
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS giveaway_leases (
+            giveaway_id INTEGER PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            FOREIGN KEY (giveaway_id) REFERENCES giveaways_v2(id)
+        )
+    ''')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_giveaway_leases_owner ON giveaway_leases (owner)')
+
+
+async def _explicit_channel_commission(db):
+    '''Комиссия канала без значения по умолчанию: NULL — действует глобальная'''
+    # SQLite не меняет DEFAULT колонки, поэтому таблица пересоздается.
+    # Прежний DEFAULT 5.0 неотличим от заданного вручную 5%, такие значения сбрасываются
+    await db.execute('''
+        CREATE TABLE channels_new (
+            channel_id TEXT PRIMARY KEY,
+            channel_name TEXT,
+            commission REAL,
+            commission_type TEXT DEFAULT 'percent',
+            active INTEGER DEFAULT 1,
+            chat_type TEXT DEFAULT 'channel',
+            added_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    await db.execute('''
+        INSERT INTO channels_new
+            (channel_id, channel_name, commission, commission_type, active, chat_type, added_by, created_at)
+        SELECT channel_id, channel_name,
+               CASE WHEN commission = 5.0 AND commission_type = 'percent' THEN NULL ELSE commission END,
+               commission_type, active, chat_type, added_by, created_at
+        FROM channels
+    ''')
+    await db.execute('DROP TABLE channels')
+    await db.execute('ALTER TABLE channels_new RENAME TO channels')
+
+
+async def _add_ad_broadcast_leases(db):
+    '''Владелец рассылки рекламы: продолжает ее только один экземпляр бота'''
+    await db.execute('ALTER TABLE ad_broadcasts ADD COLUMN owner TEXT')
+    await db.execute('ALTER TABLE ad_broadcasts ADD COLUMN expires_at REAL')
+
+
+async def _create_cache_versions(db):
+    '''Счетчики изменений админов и комиссий: по ним экземпляры бота сбрасывают свои кэши'''
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    await db.execute("INSERT OR IGNORE INTO cache_versions (name) VALUES ('admins'), ('commissions')")
+
+
+MIGRATIONS = [
+    (1, 'базовая схема', _create_base_schema),
+    (2, 'колонки channels и giveaways из старых версий', _upgrade_legacy_columns),
+    (3, 'уникальные участники и индексы', _create_indexes),
+    (4, 'дневные агрегаты статистики', _create_stats_rollup),
+    (5, 'seed случайного выбора победителей', _add_winner_seed),
+    (6, 'file_id фото розыгрышей', _add_photo_file_id),
+    (7, 'контрольные точки рассылок рекламы', _create_ad_broadcasts),
+    (8, 'аренда розыгрышей экземплярами бота', _create_giveaway_leases),
+    (9, 'комиссия канала только явно заданная', _explicit_channel_commission),
+    (10, 'аренда рассылок рекламы экземплярами бота', _add_ad_broadcast_leases),
+    (11, 'версии кэшей админов и комиссий', _create_cache_versions),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
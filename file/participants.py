@@ -0,0 +1,113 @@
+# participants.py (компактное хранение участников активного розыгрыша)
+
+import random
+from array import array
+from bisect import bisect_left
+from typing import AsyncIterable, Iterable, List
+
+# Максимальный размер одного блока отсортированных ID
+CHUNK_SIZE = 2048
+
+
+class ParticipantSet:
+    '''Множество user_id на базе отсортированных блоков array('q') (8 байт на участника).
+
+    Вставка — бинарный поиск блока и сдвиг внутри него (не более CHUNK_SIZE
+    элементов), поэтому добавление не вызывает пауз даже на миллионах участников.
+    Проверка членства — двойной бинарный поиск, len — O(1).
+    '''
+
+    __slots__ = ('_chunks', '_maxes', '_len')
+
+    def __init__(self, user_ids: Iterable[int] = ()):
+        ids = sorted(set(user_ids))
+        self._chunks = [
+            array('q', ids[i:i + CHUNK_SIZE])
+            for i in range(0, len(ids), CHUNK_SIZE)
+        ]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._len = len(ids)
+
+    def add(self, user_id: int) -> bool:
+        '''Добавление участника; False, если он уже есть'''
+        if not self._chunks:
+            self._chunks.append(array('q', (user_id,)))
+            self._maxes.append(user_id)
+            self._len = 1
+            return True
+
+        pos = bisect_left(self._maxes, user_id)
+        if pos == len(self._maxes):
+            # Больше всех известных — в конец последнего блока
+            pos -= 1
+            self._chunks[pos].append(user_id)
+            self._maxes[pos] = user_id
+        else:
+            chunk = self._chunks[pos]
+            index = bisect_left(chunk, user_id)
+            if chunk[index] == user_id:
+                return False
+            chunk.insert(index, user_id)
+
+        self._len += 1
+        chunk = self._chunks[pos]
+        if len(chunk) > CHUNK_SIZE * 2:
+            # Делим переполненный блок пополам
+            half = len(chunk) // 2
+            self._chunks[pos:pos + 1] = [chunk[:half], chunk[half:]]
+            self._maxes[pos:pos + 1] = [chunk[half - 1], chunk[-1]]
+        return True
+
+    def discard(self, user_id: int) -> bool:
+        '''Удаление участника; False, если его не было'''
+        pos = bisect_left(self._maxes, user_id)
+        if pos == len(self._maxes):
+            return False
+        chunk = self._chunks[pos]
+        index = bisect_left(chunk, user_id)
+        if chunk[index] != user_id:
+            return False
+        del chunk[index]
+        self._len -= 1
+        if not chunk:
+            del self._chunks[pos]
+            del self._maxes[pos]
+        else:
+            self._maxes[pos] = chunk[-1]
+        return True
+
+    def __contains__(self, user_id: int) -> bool:
+        pos = bisect_left(self._maxes, user_id)
+        if pos == len(self._maxes):
+            return False
+        chunk = self._chunks[pos]
+        return chunk[bisect_left(chunk, user_id)] == user_id
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield from chunk
+
+
+async def reservoir_sample(chunks: AsyncIterable[List[int]], k: int, rng: random.Random) -> List[int]:
+    '''Выбор k случайных элементов за один проход (reservoir sampling, алгоритм R).
+
+    Память — O(k) независимо от числа элементов. При одинаковом порядке
+    обхода и одинаковом seed у rng результат воспроизводится.
+    '''
+    reservoir: List[int] = []
+    if k <= 0:
+        return reservoir
+    seen = 0
+    async for chunk in chunks:
+        for item in chunk:
+            if seen < k:
+                reservoir.append(item)
+            else:
+                index = rng.randrange(seen + 1)
+                if index < k:
+                    reservoir[index] = item
+            seen += 1
+    return reservoir
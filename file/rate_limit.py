@@ -0,0 +1,173 @@
+# rate_limit.py (ограничение частоты исходящих запросов к Bot API)
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: сообщений в секунду на бота, в секунду на чат, в минуту на группу/канал
+GLOBAL_RATE = 30.0
+CHAT_RATE = 1.0
+GROUP_RATE_PER_MINUTE = 20
+CHAT_BUCKETS_SIZE = 10_000
+MAX_RETRIES = 3
+
+# Приоритеты исходящих запросов: меньше — раньше
+PRIORITY_PAYOUT = 0  # уведомления о выплатах
+PRIORITY_NORMAL = 1
+PRIORITY_COSMETIC = 2  # обновления постов розыгрышей
+PRIORITY_BULK = 3  # рассылки рекламы
+
+request_priority: ContextVar[int] = ContextVar('request_priority', default=PRIORITY_NORMAL)
+
+
+@contextmanager
+def outbound_priority(priority: int):
+    '''Приоритет всех запросов к Bot API внутри блока'''
+    token = request_priority.set(priority)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+class TokenBucket:
+    '''Ведро токенов: в среднем rate операций в секунду, всплеск до capacity.
+
+    Ожидающие получают токены по приоритету, при равном приоритете — в
+    порядке очереди. Раздачей занимается одна фоновая задача, пока есть очередь.
+    '''
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._waiters = []  # куча [priority, seq, tokens, future]
+        self._seq = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1, priority: int = PRIORITY_NORMAL):
+        '''Ожидание и списание tokens токенов'''
+        self._refill()
+        if not self._waiters and self._tokens >= tokens:
+            self._tokens -= tokens
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), tokens, future))
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    def pause(self, seconds: float):
+        '''Не выдавать токены ближайшие seconds секунд (ответ 429 от Telegram)'''
+        self._refill()
+        self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+    async def _dispatch(self):
+        try:
+            while self._waiters:
+                _, _, tokens, future = self._waiters[0]
+                if future.done():
+                    # Ожидавший отменен
+                    heapq.heappop(self._waiters)
+                    continue
+                self._refill()
+                if self._tokens >= tokens:
+                    heapq.heappop(self._waiters)
+                    self._tokens -= tokens
+                    future.set_result(None)
+                    continue
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+        finally:
+            self._dispatcher = None
+
+
+def _is_message_method(api_method: str) -> bool:
+    '''Методы, которые Telegram считает отправкой сообщения в чат'''
+    return (
+        (api_method.startswith('send') and api_method != 'sendChatAction')
+        or api_method.startswith('editMessage')
+        or api_method in ('copyMessage', 'forwardMessage')
+    )
+
+
+def _is_group_chat(chat_id) -> bool:
+    # У групп и каналов отрицательный ID или @username, у личных чатов — положительный ID
+    return isinstance(chat_id, str) or chat_id < 0
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    '''Общий планировщик исходящих запросов бота (подключается к bot.session).
+
+    Отправки и правки сообщений проходят через ведро на чат (1/с, для групп
+    и каналов еще 20/мин) и общее ведро бота (30/с) с учетом приоритета
+    из request_priority. На 429 чат ставится на паузу retry_after и запрос
+    повторяется до MAX_RETRIES раз.
+    '''
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 group_rate_per_minute: int = GROUP_RATE_PER_MINUTE, max_chats: int = CHAT_BUCKETS_SIZE):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate_per_minute = group_rate_per_minute
+        self.max_chats = max_chats
+        self._chat_buckets: OrderedDict = OrderedDict()  # chat_id -> (ведро в секунду, ведро в минуту | None)
+
+    def _buckets_for(self, chat_id):
+        buckets = self._chat_buckets.get(chat_id)
+        if buckets is None:
+            per_minute = None
+            if _is_group_chat(chat_id):
+                per_minute = TokenBucket(self.group_rate_per_minute / 60, self.group_rate_per_minute)
+            buckets = (TokenBucket(self.chat_rate, 1), per_minute)
+            self._chat_buckets[chat_id] = buckets
+            if len(self._chat_buckets) > self.max_chats:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return buckets
+
+    async def _acquire(self, chat_id, priority: int):
+        per_second, per_minute = self._buckets_for(chat_id)
+        if per_minute is not None:
+            await per_minute.acquire(priority=priority)
+        await per_second.acquire(priority=priority)
+        await self.global_bucket.acquire(priority=priority)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        limited = chat_id is not None and _is_message_method(method.__api_method__)
+        priority = request_priority.get()
+
+        for attempt in range(MAX_RETRIES + 1):
+            if limited:
+                await self._acquire(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                logger.warning(
+                    f"429 на {method.__api_method__} (чат {chat_id}), повтор через {e.retry_after} с"
+                )
+                if limited:
+                    per_second, _ = self._buckets_for(chat_id)
+                    per_second.pause(e.retry_after)
+                else:
+                    await asyncio.sleep(e.retry_after)
@@ -0,0 +1,77 @@
+# subscriptions.py (кэш проверок подписки через bot.get_chat_member)
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict
+
+# Статусы участника, которые считаются подпиской
+MEMBER_STATUSES = ('member', 'administrator', 'creator')
+
+POSITIVE_TTL = 300.0  # подписан: перепроверяем не чаще раза в 5 минут
+NEGATIVE_TTL = 20.0  # не подписан: короткий срок, чтобы пользователь мог подписаться и повторить
+CACHE_SIZE = 100_000
+
+
+class SubscriptionCache:
+    '''Ограниченный TTL-кэш подписок по ключу (chat_id, user_id).
+
+    Отдельные сроки для положительных и отрицательных ответов; параллельные
+    проверки одной пары ждут один общий запрос к API. Ошибки API не кэшируются.
+    '''
+
+    def __init__(self, bot, positive_ttl: float = POSITIVE_TTL, negative_ttl: float = NEGATIVE_TTL,
+                 max_size: int = CACHE_SIZE):
+        self.bot = bot
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()  # key -> (подписан, истекает_в)
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def is_member(self, chat_id, user_id: int) -> bool:
+        '''Подписан ли пользователь на канал/чат (исключения API пробрасываются)'''
+        key = (str(chat_id), user_id)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[0]
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch(key, chat_id, user_id))
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: tuple, chat_id, user_id: int) -> bool:
+        try:
+            member = await self.bot.get_chat_member(chat_id, user_id)
+            is_member = member.status in MEMBER_STATUSES
+            ttl = self.positive_ttl if is_member else self.negative_ttl
+            self._entries[key] = (is_member, time.monotonic() + ttl)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return is_member
+        finally:
+            del self._inflight[key]
+
+    def invalidate(self, chat_id, user_id: int):
+        '''Сброс закэшированного ответа для пары'''
+        self._entries.pop((str(chat_id), user_id), None)
+
+    def stats(self) -> Dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'size': len(self._entries),
+        }